@@ -1,10 +1,17 @@
 import unittest
-from unittest.mock import patch, MagicMock, mock_open
-from tools.llm_api import create_llm_client, query_llm, load_environment
+from unittest.mock import patch, MagicMock, AsyncMock, mock_open, ANY
+from tools.llm_api import create_llm_client, create_async_llm_client, encode_image_file, query_llm, query_llm_stream, query_llm_multi, aquery_llm, aquery_llm_batch, load_environment, main, _CLIENT_CACHE, _GEMINI_MODELS
 import os
 import google.generativeai as genai
 import io
 import sys
+import base64
+import tempfile
+import asyncio
+import openai
+import anthropic
+from tools.llm_cache import ResponseCache, SemanticCache
+from tools.rate_limiter import RateLimiter
 
 def is_llm_configured():
     """Check if LLM is configured by trying to connect to the server"""
@@ -21,10 +28,13 @@ skip_message = "Skipping LLM tests as LLM is not configured. This is normal if y
 
 class TestEnvironmentLoading(unittest.TestCase):
     def setUp(self):
+        # load_environment only runs once per process; reset it for each test
+        load_environment.cache_clear()
+        
         # Save original environment
         self.original_env = dict(os.environ)
         # Clear environment variables we're testing
-        for key in ['TEST_VAR']:
+        for key in ['TEST_VAR', 'TEST_EXPORTED', 'TEST_INDENTED']:
             if key in os.environ:
                 del os.environ[key]
 
@@ -35,15 +45,13 @@ class TestEnvironmentLoading(unittest.TestCase):
 
     @patch('pathlib.Path.exists')
     @patch('tools.llm_api.load_dotenv')
-    @patch('builtins.open')
-    def test_environment_loading_precedence(self, mock_open, mock_load_dotenv, mock_exists):
+    @patch('tools.llm_api.dotenv_values')
+    def test_environment_loading_precedence(self, mock_dotenv_values, mock_load_dotenv, mock_exists):
         # Mock all env files exist
         mock_exists.return_value = True
         
         # Mock file contents
-        mock_file = MagicMock()
-        mock_file.__enter__.return_value = io.StringIO('TEST_VAR=value\n')
-        mock_open.return_value = mock_file
+        mock_dotenv_values.return_value = {'TEST_VAR': 'value'}
         
         # Mock different values for TEST_VAR in different files
         def load_dotenv_side_effect(dotenv_path, **kwargs):
@@ -82,8 +90,121 @@ class TestEnvironmentLoading(unittest.TestCase):
         # Verify load_dotenv was not called
         mock_load_dotenv.assert_not_called()
 
+    @patch('pathlib.Path.exists')
+    @patch('tools.llm_api.load_dotenv')
+    def test_environment_loading_runs_once(self, mock_load_dotenv, mock_exists):
+        mock_exists.return_value = True
+        load_environment()
+        load_environment()
+        self.assertEqual(mock_load_dotenv.call_count, 3)
+
+    @patch('pathlib.Path.exists')
+    @patch('tools.llm_api.load_dotenv')
+    @patch('tools.llm_api.dotenv_values')
+    def test_environment_loading_quiet_without_debug(self, mock_dotenv_values, mock_load_dotenv, mock_exists):
+        mock_exists.return_value = True
+        os.environ.pop('LLM_API_DEBUG', None)
+        with patch('sys.stderr', new_callable=io.StringIO) as mock_stderr:
+            load_environment()
+        self.assertEqual(mock_stderr.getvalue(), "")
+        # Keys are only listed, and the files only re-read, in debug mode
+        mock_dotenv_values.assert_not_called()
+
+    @patch('pathlib.Path.exists')
+    @patch('tools.llm_api.load_dotenv')
+    @patch('tools.llm_api.dotenv_values')
+    def test_environment_loading_debug_lists_keys(self, mock_dotenv_values, mock_load_dotenv, mock_exists):
+        mock_exists.return_value = True
+        mock_dotenv_values.return_value = {'TEST_VAR': 'value'}
+        os.environ['LLM_API_DEBUG'] = '1'
+        with patch('sys.stderr', new_callable=io.StringIO) as mock_stderr:
+            load_environment()
+        self.assertIn("Keys loaded from .env.local: ['TEST_VAR']", mock_stderr.getvalue())
+
+    def test_environment_debug_keys_from_real_file(self):
+        # Keys come from python-dotenv's parser, not a naive split on '='
+        with tempfile.TemporaryDirectory() as tmpdir:
+            with open(os.path.join(tmpdir, '.env'), 'w') as f:
+                f.write('# COMMENTED=out\n')
+                f.write('TEST_VAR="a=b"\n')
+                f.write('export TEST_EXPORTED=value\n')
+                f.write('  TEST_INDENTED = value # trailing=comment\n')
+            original_cwd = os.getcwd()
+            os.chdir(tmpdir)
+            try:
+                os.environ['LLM_API_DEBUG'] = '1'
+                with patch('sys.stderr', new_callable=io.StringIO) as mock_stderr:
+                    load_environment()
+            finally:
+                os.chdir(original_cwd)
+        self.assertIn("Keys loaded from .env: ['TEST_VAR', 'TEST_EXPORTED', 'TEST_INDENTED']", mock_stderr.getvalue())
+        self.assertEqual(os.environ.get('TEST_VAR'), 'a=b')
+
+    def test_query_loads_environment_before_reading_settings(self):
+        # Settings from .env apply on the first call, even with a caller-supplied client
+        mock_client = MagicMock()
+        mock_client.chat.completions.create.return_value.choices[0].message.content = "Test Azure OpenAI response"
+        os.environ.pop('AZURE_OPENAI_MODEL_DEPLOYMENT', None)
+        with tempfile.TemporaryDirectory() as tmpdir:
+            with open(os.path.join(tmpdir, '.env'), 'w') as f:
+                f.write('AZURE_OPENAI_MODEL_DEPLOYMENT=my-deploy\n')
+            original_cwd = os.getcwd()
+            os.chdir(tmpdir)
+            try:
+                with patch('tools.llm_api.get_response_cache', return_value=ResponseCache()), \
+                     patch('tools.llm_api.get_rate_limiter', return_value=RateLimiter()):
+                    query_llm("Test prompt", client=mock_client, provider="azure")
+            finally:
+                os.chdir(original_cwd)
+        self.assertEqual(mock_client.chat.completions.create.call_args[1]["model"], "my-deploy")
+
+class TestEncodeImageFile(unittest.TestCase):
+    def test_encode_matches_base64(self):
+        # Larger than one chunk and not a multiple of 3 bytes
+        data = os.urandom(200 * 1024 + 1)
+        with tempfile.TemporaryDirectory() as tmpdir:
+            image_path = os.path.join(tmpdir, "screenshot.png")
+            with open(image_path, "wb") as f:
+                f.write(data)
+            encoded, mime_type = encode_image_file(image_path)
+        self.assertEqual(encoded, base64.b64encode(data).decode('ascii'))
+        self.assertEqual(mime_type, "image/png")
+
+    def test_encode_guesses_mime_type(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            image_path = os.path.join(tmpdir, "photo.jpg")
+            with open(image_path, "wb") as f:
+                f.write(b"jpeg")
+            self.assertEqual(encode_image_file(image_path), (base64.b64encode(b"jpeg").decode('ascii'), "image/jpeg"))
+
+    def test_encode_is_cached_until_file_changes(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            image_path = os.path.join(tmpdir, "screenshot.png")
+            with open(image_path, "wb") as f:
+                f.write(b"first")
+            with patch('builtins.open', wraps=open) as mock_file_open:
+                first = encode_image_file(image_path)
+                self.assertEqual(encode_image_file(image_path), first)
+                self.assertEqual(mock_file_open.call_count, 1)
+            
+            with open(image_path, "wb") as f:
+                f.write(b"second!")
+            self.assertEqual(encode_image_file(image_path)[0], base64.b64encode(b"second!").decode('ascii'))
+
 class TestLLMAPI(unittest.TestCase):
     def setUp(self):
+        # Start each test without clients cached by earlier tests
+        _CLIENT_CACHE.clear()
+        _GEMINI_MODELS.clear()
+        
+        # Use a fresh in-memory response cache per test
+        self.cache_patcher = patch('tools.llm_api.get_response_cache', return_value=ResponseCache())
+        self.cache_patcher.start()
+        
+        # Don't pace requests against provider rate limits in tests
+        self.limiter_patcher = patch('tools.llm_api.get_rate_limiter', return_value=RateLimiter())
+        self.limiter_patcher.start()
+        
         # Create mock clients for different providers
         self.mock_openai_client = MagicMock()
         self.mock_anthropic_client = MagicMock()
@@ -144,13 +265,15 @@ class TestLLMAPI(unittest.TestCase):
 
     def tearDown(self):
         self.env_patcher.stop()
+        self.cache_patcher.stop()
+        self.limiter_patcher.stop()
 
     @unittest.skipIf(skip_llm_tests, skip_message)
     @patch('tools.llm_api.OpenAI')
     def test_create_openai_client(self, mock_openai):
         mock_openai.return_value = self.mock_openai_client
         client = create_llm_client("openai")
-        mock_openai.assert_called_once_with(api_key='test-openai-key')
+        mock_openai.assert_called_once_with(api_key='test-openai-key', max_retries=0, http_client=ANY)
         self.assertEqual(client, self.mock_openai_client)
 
     @unittest.skipIf(skip_llm_tests, skip_message)
@@ -161,7 +284,9 @@ class TestLLMAPI(unittest.TestCase):
         mock_azure.assert_called_once_with(
             api_key='test-azure-key',
             api_version="2024-08-01-preview",
-            azure_endpoint="https://msopenai.openai.azure.com"
+            azure_endpoint="https://msopenai.openai.azure.com",
+            max_retries=0,
+            http_client=ANY
         )
         self.assertEqual(client, self.mock_azure_client)
 
@@ -172,7 +297,9 @@ class TestLLMAPI(unittest.TestCase):
         client = create_llm_client("deepseek")
         mock_openai.assert_called_once_with(
             api_key='test-deepseek-key',
-            base_url="https://api.deepseek.com/v1"
+            base_url="https://api.deepseek.com/v1",
+            max_retries=0,
+            http_client=ANY
         )
         self.assertEqual(client, self.mock_openai_client)
 
@@ -183,7 +310,9 @@ class TestLLMAPI(unittest.TestCase):
         client = create_llm_client("siliconflow")
         mock_openai.assert_called_once_with(
             api_key='test-siliconflow-key',
-            base_url="https://api.siliconflow.cn/v1"
+            base_url="https://api.siliconflow.cn/v1",
+            max_retries=0,
+            http_client=ANY
         )
         self.assertEqual(client, self.mock_openai_client)
 
@@ -192,7 +321,7 @@ class TestLLMAPI(unittest.TestCase):
     def test_create_anthropic_client(self, mock_anthropic):
         mock_anthropic.return_value = self.mock_anthropic_client
         client = create_llm_client("anthropic")
-        mock_anthropic.assert_called_once_with(api_key='test-anthropic-key')
+        mock_anthropic.assert_called_once_with(api_key='test-anthropic-key', max_retries=0, http_client=ANY)
         self.assertEqual(client, self.mock_anthropic_client)
 
     @unittest.skipIf(skip_llm_tests, skip_message)
@@ -209,7 +338,9 @@ class TestLLMAPI(unittest.TestCase):
         client = create_llm_client("local")
         mock_openai.assert_called_once_with(
             base_url="http://192.168.180.137:8006/v1",
-            api_key="not-needed"
+            api_key="not-needed",
+            max_retries=0,
+            http_client=ANY
         )
         self.assertEqual(client, self.mock_openai_client)
 
@@ -218,6 +349,78 @@ class TestLLMAPI(unittest.TestCase):
         with self.assertRaises(ValueError):
             create_llm_client("invalid_provider")
 
+    @patch('tools.llm_api.OpenAI')
+    def test_create_client_is_cached(self, mock_openai):
+        mock_openai.return_value = self.mock_openai_client
+        first = create_llm_client("openai")
+        second = create_llm_client("openai")
+        self.assertIs(first, second)
+        mock_openai.assert_called_once()
+
+    @patch('tools.llm_api.OpenAI')
+    def test_create_client_cache_keyed_by_api_key(self, mock_openai):
+        mock_openai.side_effect = [MagicMock(), MagicMock()]
+        first = create_llm_client("openai")
+        with patch.dict('os.environ', {'OPENAI_API_KEY': 'rotated-key'}):
+            second = create_llm_client("openai")
+        self.assertIsNot(first, second)
+        self.assertEqual(mock_openai.call_count, 2)
+
+    @patch('tools.llm_api.Anthropic')
+    @patch('tools.llm_api.OpenAI')
+    def test_create_client_owns_http_client(self, mock_openai, mock_anthropic):
+        create_llm_client("openai")
+        create_llm_client("anthropic")
+        openai_http = mock_openai.call_args.kwargs['http_client']
+        anthropic_http = mock_anthropic.call_args.kwargs['http_client']
+        self.assertIsInstance(openai_http, openai.DefaultHttpxClient)
+        self.assertIsInstance(anthropic_http, anthropic.DefaultHttpxClient)
+        openai_http.close()
+        anthropic_http.close()
+
+    # The SDK classes are not mocked below, so an HTTP client an SDK rejects fails here; no request is sent
+    def test_create_real_openai_client(self):
+        client = create_llm_client("openai")
+        self.assertIsInstance(client, openai.OpenAI)
+        self.assertIsInstance(client._client, openai.DefaultHttpxClient)
+        self.assertEqual(client.max_retries, 0)
+        client.close()
+
+    def test_create_real_azure_client(self):
+        client = create_llm_client("azure")
+        self.assertIsInstance(client, openai.AzureOpenAI)
+        self.assertIsInstance(client._client, openai.DefaultHttpxClient)
+        client.close()
+
+    def test_create_real_anthropic_client(self):
+        client = create_llm_client("anthropic")
+        self.assertIsInstance(client, anthropic.Anthropic)
+        self.assertIsInstance(client._client, anthropic.DefaultHttpxClient)
+        self.assertEqual(client.max_retries, 0)
+        client.close()
+
+    def test_create_real_async_clients(self):
+        async def build_and_close():
+            openai_client = create_async_llm_client("openai")
+            anthropic_client = create_async_llm_client("anthropic")
+            self.assertIsInstance(openai_client._client, openai.DefaultAsyncHttpxClient)
+            self.assertIsInstance(anthropic_client._client, anthropic.DefaultAsyncHttpxClient)
+            await openai_client.close()
+            await anthropic_client.close()
+        
+        asyncio.run(build_and_close())
+
+    @patch('tools.llm_api._new_http_client')
+    @patch('tools.llm_api.genai')
+    def test_create_client_without_http_client(self, mock_genai, mock_new_http_client):
+        create_llm_client("gemini")
+        with self.assertRaises(ValueError):
+            create_llm_client("invalid_provider")
+        with patch.dict('os.environ', {'OPENAI_API_KEY': ''}):
+            with self.assertRaises(ValueError):
+                create_llm_client("openai")
+        mock_new_http_client.assert_not_called()
+
     @unittest.skipIf(skip_llm_tests, skip_message)
     @patch('tools.llm_api.create_llm_client')
     def test_query_openai(self, mock_create_client):
@@ -230,6 +433,64 @@ class TestLLMAPI(unittest.TestCase):
             temperature=0.7
         )
 
+    @patch('tools.llm_api.encode_image_file')
+    @patch('tools.llm_api.create_llm_client')
+    def test_query_openai_with_image(self, mock_create_client, mock_encode):
+        mock_create_client.return_value = self.mock_openai_client
+        mock_encode.return_value = ("ZW5jb2RlZA==", "image/png")
+        with patch('tools.llm_api._response_cache_key', return_value=None):
+            response = query_llm("Test prompt", provider="openai", image_path="screenshot.png")
+        self.assertEqual(response, "Test OpenAI response")
+        self.mock_openai_client.chat.completions.create.assert_called_once_with(
+            model="gpt-4o",
+            messages=[{"role": "user", "content": [
+                {"type": "text", "text": "Test prompt"},
+                {"type": "image_url", "image_url": {"url": "data:image/png;base64,ZW5jb2RlZA=="}}
+            ]}],
+            temperature=0.7
+        )
+
+    @patch('tools.llm_api.encode_image_file')
+    def test_query_cache_hit_skips_image_encoding(self, mock_encode):
+        mock_encode.return_value = ("ZW5jb2RlZA==", "image/png")
+        with tempfile.TemporaryDirectory() as tmpdir:
+            image_path = os.path.join(tmpdir, "screenshot.png")
+            with open(image_path, "wb") as f:
+                f.write(b"image bytes")
+            query_llm("Test prompt", client=self.mock_openai_client, image_path=image_path, temperature=0)
+            response = query_llm("Test prompt", client=self.mock_openai_client, image_path=image_path, temperature=0)
+        self.assertEqual(response, "Test OpenAI response")
+        mock_encode.assert_called_once_with(image_path)
+
+    def test_query_anthropic_with_image(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            image_path = os.path.join(tmpdir, "screenshot.png")
+            with open(image_path, "wb") as f:
+                f.write(b"image")
+            response = query_llm("Test prompt", client=self.mock_anthropic_client, provider="anthropic", image_path=image_path)
+        self.assertEqual(response, "Test Anthropic response")
+        self.assertEqual(self.mock_anthropic_client.messages.create.call_args[1]["messages"], [{"role": "user", "content": [
+            {"type": "text", "text": "Test prompt"},
+            {"type": "image", "source": {"type": "base64", "media_type": "image/png", "data": base64.b64encode(b"image").decode('ascii')}}
+        ]}])
+
+    def test_query_missing_image(self):
+        response = query_llm("Test prompt", client=self.mock_openai_client, image_path="/nonexistent/screenshot.png")
+        self.assertIsNone(response)
+        self.mock_openai_client.chat.completions.create.assert_not_called()
+
+    @patch('tools.llm_api.encode_image_file')
+    @patch('tools.llm_api.create_llm_client')
+    def test_query_local_ignores_image(self, mock_create_client, mock_encode):
+        mock_create_client.return_value = self.mock_openai_client
+        with patch('tools.llm_api._response_cache_key', return_value=None):
+            query_llm("Test prompt", provider="local", image_path="screenshot.png")
+        mock_encode.assert_not_called()
+        self.assertEqual(
+            self.mock_openai_client.chat.completions.create.call_args[1]["messages"],
+            [{"role": "user", "content": [{"type": "text", "text": "Test prompt"}]}]
+        )
+
     @unittest.skipIf(skip_llm_tests, skip_message)
     @patch('tools.llm_api.create_llm_client')
     def test_query_azure(self, mock_create_client):
@@ -274,7 +535,7 @@ class TestLLMAPI(unittest.TestCase):
         response = query_llm("Test prompt", provider="anthropic")
         self.assertEqual(response, "Test Anthropic response")
         self.mock_anthropic_client.messages.create.assert_called_once_with(
-            model="claude-3-sonnet-20240229",
+            model="claude-3-5-sonnet-20241022",
             max_tokens=1000,
             messages=[{"role": "user", "content": [{"type": "text", "text": "Test prompt"}]}]
         )
@@ -288,6 +549,19 @@ class TestLLMAPI(unittest.TestCase):
         self.mock_gemini_client.GenerativeModel.assert_called_once_with("gemini-pro")
         self.mock_gemini_model.generate_content.assert_called_once_with("Test prompt")
 
+    def test_query_gemini_reuses_model(self):
+        query_llm("First prompt", client=self.mock_gemini_client, provider="gemini")
+        query_llm("Second prompt", client=self.mock_gemini_client, provider="gemini")
+        self.mock_gemini_client.GenerativeModel.assert_called_once_with("gemini-pro")
+        query_llm("First prompt", client=self.mock_gemini_client, model="gemini-1.5-pro", provider="gemini")
+        self.assertEqual(self.mock_gemini_client.GenerativeModel.call_count, 2)
+
+    def test_query_gemini_model_keyed_by_api_key(self):
+        query_llm("Test prompt", client=self.mock_gemini_client, provider="gemini")
+        with patch.dict('os.environ', {'GOOGLE_API_KEY': 'rotated-key'}):
+            query_llm("Test prompt", client=self.mock_gemini_client, provider="gemini")
+        self.assertEqual(self.mock_gemini_client.GenerativeModel.call_count, 2)
+
     @unittest.skipIf(skip_llm_tests, skip_message)
     @patch('tools.llm_api.create_llm_client')
     def test_query_local(self, mock_create_client):
@@ -332,6 +606,215 @@ class TestLLMAPI(unittest.TestCase):
         self.assertEqual(response, "Test OpenAI response")
         mock_create_client.assert_not_called()
 
+    @patch('tools.llm_api.create_llm_client')
+    def test_query_uses_response_cache(self, mock_create_client):
+        mock_create_client.return_value = self.mock_openai_client
+        self.assertEqual(query_llm("Test prompt", temperature=0), "Test OpenAI response")
+        self.assertEqual(query_llm("Test prompt", temperature=0), "Test OpenAI response")
+        self.mock_openai_client.chat.completions.create.assert_called_once()
+        self.assertEqual(self.mock_openai_client.chat.completions.create.call_args[1]["temperature"], 0)
+        
+        # A different model is a different cache entry
+        query_llm("Test prompt", model="custom-model", temperature=0)
+        self.assertEqual(self.mock_openai_client.chat.completions.create.call_count, 2)
+
+    @patch('tools.llm_api.create_llm_client')
+    def test_query_sampled_not_cached(self, mock_create_client):
+        # Asking again at the default temperature gets a fresh answer
+        mock_create_client.return_value = self.mock_openai_client
+        query_llm("Test prompt")
+        query_llm("Test prompt")
+        query_llm("Test prompt", temperature=0.7)
+        self.assertEqual(self.mock_openai_client.chat.completions.create.call_count, 3)
+
+    @patch('tools.llm_api.create_llm_client')
+    def test_query_no_cache(self, mock_create_client):
+        mock_create_client.return_value = self.mock_openai_client
+        query_llm("Test prompt", temperature=0)
+        query_llm("Test prompt", temperature=0, no_cache=True)
+        self.assertEqual(self.mock_openai_client.chat.completions.create.call_count, 2)
+
+    def test_query_temperature_passed_to_provider(self):
+        query_llm("Test prompt", client=self.mock_anthropic_client, provider="anthropic", temperature=0)
+        self.assertEqual(self.mock_anthropic_client.messages.create.call_args[1]["temperature"], 0)
+        chat_session = self.mock_gemini_model.start_chat.return_value
+        query_llm("Test prompt", client=self.mock_gemini_client, provider="gemini", temperature=0.2)
+        chat_session.send_message.assert_called_once_with("Test prompt", generation_config={"temperature": 0.2})
+
+    @patch('tools.llm_api._embed_prompt')
+    @patch('tools.llm_api.get_semantic_cache')
+    @patch('tools.llm_api.create_llm_client')
+    def test_query_semantic_cache(self, mock_create_client, mock_get_semantic_cache, mock_embed):
+        mock_create_client.return_value = self.mock_openai_client
+        mock_get_semantic_cache.return_value = SemanticCache()
+        embeddings = {"Capital of France?": [1.0, 0.0], "France's capital?": [0.98, 0.05]}
+        mock_embed.side_effect = lambda prompt: embeddings[prompt]
+        
+        self.assertEqual(query_llm("Capital of France?", semantic_cache=True, temperature=0), "Test OpenAI response")
+        self.assertEqual(query_llm("France's capital?", semantic_cache=True, temperature=0), "Test OpenAI response")
+        self.mock_openai_client.chat.completions.create.assert_called_once()
+
+    def test_query_stream_openai(self):
+        chunks = []
+        for text in ["Test ", None, "OpenAI ", "response"]:
+            chunk = MagicMock()
+            chunk.choices[0].delta.content = text
+            chunks.append(chunk)
+        self.mock_openai_client.chat.completions.create.return_value = iter(chunks)
+        response = list(query_llm_stream("Test prompt", client=self.mock_openai_client))
+        self.assertEqual(response, ["Test ", "OpenAI ", "response"])
+        self.mock_openai_client.chat.completions.create.assert_called_once_with(
+            stream=True,
+            model="gpt-4o",
+            messages=[{"role": "user", "content": [{"type": "text", "text": "Test prompt"}]}],
+            temperature=0.7
+        )
+
+    def test_query_stream_anthropic(self):
+        mock_stream = MagicMock()
+        mock_stream.text_stream = iter(["Test ", "Anthropic ", "response"])
+        self.mock_anthropic_client.messages.stream.return_value.__enter__.return_value = mock_stream
+        response = list(query_llm_stream("Test prompt", client=self.mock_anthropic_client, provider="anthropic"))
+        self.assertEqual(response, ["Test ", "Anthropic ", "response"])
+        self.mock_anthropic_client.messages.stream.assert_called_once_with(
+            model="claude-3-5-sonnet-20241022",
+            max_tokens=1000,
+            messages=[{"role": "user", "content": [{"type": "text", "text": "Test prompt"}]}]
+        )
+
+    def test_query_stream_error(self):
+        self.mock_openai_client.chat.completions.create.side_effect = Exception("Test error")
+        response = list(query_llm_stream("Test prompt", client=self.mock_openai_client))
+        self.assertEqual(response, [])
+
+    def test_query_multi_openai(self):
+        # Choices may come back out of order
+        choices = [MagicMock(index=1, text="Second"), MagicMock(index=0, text="First")]
+        self.mock_openai_client.completions.create.return_value = MagicMock(choices=choices)
+        response = query_llm_multi(["prompt 0", "prompt 1"], client=self.mock_openai_client)
+        self.assertEqual(response, ["First", "Second"])
+        self.mock_openai_client.completions.create.assert_called_once_with(
+            model="gpt-3.5-turbo-instruct",
+            prompt=["prompt 0", "prompt 1"],
+            max_tokens=1000
+        )
+
+    def test_query_multi_anthropic(self):
+        batches = self.mock_anthropic_client.messages.batches
+        batches.create.return_value = MagicMock(id="batch-1", processing_status="in_progress")
+        batches.retrieve.return_value = MagicMock(id="batch-1", processing_status="ended")
+        succeeded = MagicMock(custom_id="1")
+        succeeded.result.type = "succeeded"
+        succeeded.result.message.content = [MagicMock(text="Second")]
+        errored = MagicMock(custom_id="0")
+        errored.result.type = "errored"
+        batches.results.return_value = iter([succeeded, errored])
+        
+        response = query_llm_multi(["prompt 0", "prompt 1"], client=self.mock_anthropic_client,
+                                   provider="anthropic", poll_interval=0)
+        self.assertEqual(response, [None, "Second"])
+        requests = batches.create.call_args[1]["requests"]
+        self.assertEqual([r["custom_id"] for r in requests], ["0", "1"])
+        self.assertEqual(requests[1]["params"]["messages"],
+                         [{"role": "user", "content": [{"type": "text", "text": "prompt 1"}]}])
+        batches.retrieve.assert_called_once_with("batch-1")
+
+    def test_query_multi_anthropic_timeout(self):
+        batches = self.mock_anthropic_client.messages.batches
+        batches.create.return_value = MagicMock(id="batch-1", processing_status="in_progress")
+        with patch('sys.stderr', new_callable=io.StringIO):
+            response = query_llm_multi(["prompt 0", "prompt 1"], client=self.mock_anthropic_client,
+                                       provider="anthropic", timeout=0)
+        self.assertEqual(response, [None, None])
+        batches.cancel.assert_called_once_with("batch-1")
+        batches.results.assert_not_called()
+
+    def test_query_multi_azure_requires_model(self):
+        with self.assertRaises(ValueError):
+            query_llm_multi(["prompt 0"], client=self.mock_azure_client, provider="azure")
+        self.mock_azure_client.completions.create.assert_not_called()
+
+    @patch('tools.llm_api.query_llm')
+    def test_query_multi_falls_back_to_concurrent(self, mock_query):
+        mock_query.side_effect = lambda prompt, client, **kwargs: prompt.upper()
+        response = query_llm_multi(["prompt 0", "prompt 1"], client=self.mock_openai_client, provider="deepseek")
+        self.assertEqual(response, ["PROMPT 0", "PROMPT 1"])
+        mock_query.assert_any_call("prompt 0", self.mock_openai_client, model=None, provider="deepseek")
+
+    @patch('tools.llm_api.query_llm')
+    def test_query_multi_falls_back_inside_event_loop(self, mock_query):
+        mock_query.return_value = "Response"
+        
+        async def call():
+            return query_llm_multi(["prompt 0"], client=self.mock_gemini_client, provider="gemini")
+        
+        self.assertEqual(asyncio.run(call()), ["Response"])
+
+    @patch('tools.llm_api.query_llm')
+    def test_query_multi_fallback_error(self, mock_query):
+        mock_query.side_effect = RuntimeError("interpreter shutdown")
+        with patch('sys.stderr', new_callable=io.StringIO):
+            response = query_llm_multi(["prompt 0", "prompt 1"], client=self.mock_openai_client, provider="deepseek")
+        self.assertEqual(response, [None, None])
+
+    def test_query_multi_error(self):
+        self.mock_openai_client.completions.create.side_effect = Exception("Test error")
+        response = query_llm_multi(["prompt 0", "prompt 1"], client=self.mock_openai_client)
+        self.assertEqual(response, [None, None])
+
+    @patch('tools.llm_api.create_llm_client')
+    def test_query_acquires_rate_limit(self, mock_create_client):
+        mock_create_client.return_value = self.mock_openai_client
+        limiter = MagicMock()
+        with patch('tools.llm_api.get_rate_limiter', return_value=limiter) as mock_get_limiter:
+            query_llm("Test prompt")
+        mock_get_limiter.assert_called_once_with("openai")
+        limiter.acquire.assert_called_once()
+        self.assertGreater(limiter.acquire.call_args[0][0], 1000)
+
+    @patch('tools.llm_api.estimate_tokens')
+    def test_query_skips_token_estimate_without_token_limit(self, mock_estimate):
+        with patch('tools.llm_api.get_rate_limiter', return_value=RateLimiter(rpm=100)):
+            query_llm("Test prompt", client=self.mock_openai_client)
+            query_llm_multi(["prompt 0"], client=self.mock_openai_client)
+        mock_estimate.assert_not_called()
+
+    @patch('tools.llm_api.estimate_tokens', return_value=5)
+    def test_query_stream_records_usage(self, mock_estimate):
+        chunk = MagicMock()
+        chunk.choices[0].delta.content = "Test OpenAI response"
+        self.mock_openai_client.chat.completions.create.return_value = iter([chunk])
+        limiter = MagicMock()
+        with patch('tools.llm_api.get_rate_limiter', return_value=limiter):
+            list(query_llm_stream("Test prompt", client=self.mock_openai_client))
+        # Estimated from the prompt and the streamed text, 5 tokens each
+        limiter.record_usage.assert_called_once_with(limiter.acquire.return_value, 10)
+
+    def test_query_multi_records_usage(self):
+        response = MagicMock(choices=[MagicMock(index=0, text="First")])
+        response.usage.total_tokens = 42
+        self.mock_openai_client.completions.create.return_value = response
+        limiter = MagicMock()
+        with patch('tools.llm_api.get_rate_limiter', return_value=limiter):
+            query_llm_multi(["prompt 0"], client=self.mock_openai_client)
+        limiter.record_usage.assert_called_once_with(limiter.acquire.return_value, 42)
+
+    def test_query_gemini_records_usage(self):
+        chat_session = self.mock_gemini_model.start_chat.return_value
+        chat_session.send_message.return_value.usage_metadata.total_token_count = 42
+        limiter = MagicMock()
+        with patch('tools.llm_api.get_rate_limiter', return_value=limiter):
+            query_llm("Test prompt", client=self.mock_gemini_client, provider="gemini")
+        limiter.record_usage.assert_called_once_with(limiter.acquire.return_value, 42)
+
+    def test_query_anthropic_records_usage(self):
+        self.mock_anthropic_response.usage.input_tokens = 10
+        self.mock_anthropic_response.usage.output_tokens = 5
+        limiter = MagicMock()
+        with patch('tools.llm_api.get_rate_limiter', return_value=limiter):
+            query_llm("Test prompt", client=self.mock_anthropic_client, provider="anthropic")
+        limiter.record_usage.assert_called_once_with(limiter.acquire.return_value, 15)
+
     @unittest.skipIf(skip_llm_tests, skip_message)
     @patch('tools.llm_api.create_llm_client')
     def test_query_error(self, mock_create_client):
@@ -339,6 +822,162 @@ class TestLLMAPI(unittest.TestCase):
         mock_create_client.return_value = self.mock_openai_client
         response = query_llm("Test prompt")
         self.assertIsNone(response)
+        # Unexpected errors are not retried
+        self.mock_openai_client.chat.completions.create.assert_called_once()
+
+    @patch('tools.llm_api.time.sleep')
+    @patch('tools.llm_api.create_llm_client')
+    def test_query_retries_transient_error(self, mock_create_client, mock_sleep):
+        connection_error = openai.APIConnectionError(request=MagicMock())
+        self.mock_openai_client.chat.completions.create.side_effect = [connection_error, self.mock_openai_response]
+        mock_create_client.return_value = self.mock_openai_client
+        response = query_llm("Test prompt")
+        self.assertEqual(response, "Test OpenAI response")
+        self.assertEqual(self.mock_openai_client.chat.completions.create.call_count, 2)
+        mock_sleep.assert_called_once()
+        self.assertTrue(1 <= mock_sleep.call_args[0][0] < 2)
+
+    @patch('tools.llm_api.time.sleep')
+    def test_query_retries_anthropic_overloaded(self, mock_sleep):
+        overloaded = anthropic.OverloadedError("Overloaded", response=MagicMock(status_code=529), body=None)
+        self.mock_anthropic_client.messages.create.side_effect = [overloaded, self.mock_anthropic_response]
+        response = query_llm("Test prompt", client=self.mock_anthropic_client, provider="anthropic")
+        self.assertEqual(response, "Test Anthropic response")
+        self.assertEqual(self.mock_anthropic_client.messages.create.call_count, 2)
+        mock_sleep.assert_called_once()
+
+    @patch('tools.llm_api.time.sleep')
+    @patch('tools.llm_api.create_llm_client')
+    def test_query_gives_up_after_retries(self, mock_create_client, mock_sleep):
+        connection_error = openai.APIConnectionError(request=MagicMock())
+        self.mock_openai_client.chat.completions.create.side_effect = connection_error
+        mock_create_client.return_value = self.mock_openai_client
+        response = query_llm("Test prompt")
+        self.assertIsNone(response)
+        self.assertEqual(self.mock_openai_client.chat.completions.create.call_count, 3)
+        self.assertEqual(mock_sleep.call_count, 2)
+
+class TestAsyncLLMAPI(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.mock_openai_client = MagicMock()
+        self.mock_openai_client.chat.completions.create = AsyncMock(
+            side_effect=lambda **kwargs: MagicMock(choices=[MagicMock(message=MagicMock(
+                content=f"Response to {kwargs['messages'][0]['content'][0]['text']}"
+            ))])
+        )
+        self.mock_openai_client.close = AsyncMock()
+
+        self.mock_anthropic_client = MagicMock()
+        self.mock_anthropic_client.messages.create = AsyncMock(
+            return_value=MagicMock(content=[MagicMock(text="Test Anthropic response")])
+        )
+
+        self.cache_patcher = patch('tools.llm_api.get_response_cache', return_value=ResponseCache())
+        self.cache_patcher.start()
+        self.limiter_patcher = patch('tools.llm_api.get_rate_limiter', return_value=RateLimiter())
+        self.limiter_patcher.start()
+
+    def tearDown(self):
+        self.cache_patcher.stop()
+        self.limiter_patcher.stop()
+
+    async def test_aquery_openai(self):
+        response = await aquery_llm("Test prompt", client=self.mock_openai_client)
+        self.assertEqual(response, "Response to Test prompt")
+        self.mock_openai_client.chat.completions.create.assert_awaited_once_with(
+            model="gpt-4o",
+            messages=[{"role": "user", "content": [{"type": "text", "text": "Test prompt"}]}],
+            temperature=0.7
+        )
+        # A client passed in by the caller is left open
+        self.mock_openai_client.close.assert_not_awaited()
+
+    async def test_aquery_anthropic(self):
+        response = await aquery_llm("Test prompt", client=self.mock_anthropic_client, provider="anthropic")
+        self.assertEqual(response, "Test Anthropic response")
+        self.mock_anthropic_client.messages.create.assert_awaited_once_with(
+            model="claude-3-5-sonnet-20241022",
+            max_tokens=1000,
+            messages=[{"role": "user", "content": [{"type": "text", "text": "Test prompt"}]}]
+        )
+
+    @patch('tools.llm_api.asyncio.sleep', new_callable=AsyncMock)
+    async def test_aquery_retries_transient_error(self, mock_sleep):
+        connection_error = openai.APIConnectionError(request=MagicMock())
+        self.mock_openai_client.chat.completions.create.side_effect = [
+            connection_error,
+            MagicMock(choices=[MagicMock(message=MagicMock(content="Test OpenAI response"))])
+        ]
+        response = await aquery_llm("Test prompt", client=self.mock_openai_client)
+        self.assertEqual(response, "Test OpenAI response")
+        self.assertEqual(self.mock_openai_client.chat.completions.create.await_count, 2)
+        mock_sleep.assert_awaited_once()
+
+    async def test_aquery_error(self):
+        self.mock_openai_client.chat.completions.create.side_effect = Exception("Test error")
+        response = await aquery_llm("Test prompt", client=self.mock_openai_client)
+        self.assertIsNone(response)
+
+    @patch('tools.llm_api.create_async_llm_client')
+    async def test_aquery_batch_coalesces_cache_writes(self, mock_create_client):
+        mock_create_client.return_value = self.mock_openai_client
+        cache = MagicMock(wraps=ResponseCache())
+        with patch('tools.llm_api.get_response_cache', return_value=cache):
+            await aquery_llm_batch(["prompt 0", "prompt 1", "prompt 2"], temperature=0)
+            cache.set.assert_not_called()
+            cache.set_many.assert_called_once()
+            self.assertEqual(len(cache.set_many.call_args[0][0]), 3)
+            
+            # The stored responses are served on the next batch
+            responses = await aquery_llm_batch(["prompt 0", "prompt 1", "prompt 2"], temperature=0)
+        self.assertEqual(responses, [f"Response to prompt {i}" for i in range(3)])
+        self.assertEqual(self.mock_openai_client.chat.completions.create.await_count, 3)
+
+    @patch('tools.llm_api.create_async_llm_client')
+    async def test_aquery_batch_preserves_order(self, mock_create_client):
+        mock_create_client.return_value = self.mock_openai_client
+        prompts = [f"prompt {i}" for i in range(5)]
+        responses = await aquery_llm_batch(prompts, concurrency=2)
+        self.assertEqual(responses, [f"Response to prompt {i}" for i in range(5)])
+        self.assertEqual(self.mock_openai_client.chat.completions.create.await_count, 5)
+        mock_create_client.assert_called_once_with("openai")
+        self.mock_openai_client.close.assert_awaited_once()
+
+class TestMain(unittest.TestCase):
+    @patch('tools.llm_api.load_environment')
+    @patch('tools.llm_api.create_llm_client')
+    @patch('tools.llm_api.query_llm')
+    def test_single_prompt(self, mock_query, mock_create_client, mock_load_env):
+        mock_query.return_value = "Paris"
+        with patch('sys.argv', ['llm_api.py', '--prompt', 'Capital of France?']), \
+             patch('sys.stdout', new_callable=io.StringIO) as mock_stdout:
+            main()
+        self.assertEqual(mock_stdout.getvalue(), "Paris\n")
+        mock_query.assert_called_once_with(
+            'Capital of France?', mock_create_client.return_value, model="gpt-4o", provider="openai",
+            image_path=None, no_cache=False, semantic_cache=False, temperature=None
+        )
+
+    @patch('tools.llm_api.load_environment')
+    @patch('tools.llm_api.create_llm_client')
+    @patch('tools.llm_api.query_llm')
+    def test_repl_reuses_client(self, mock_query, mock_create_client, mock_load_env):
+        mock_query.side_effect = lambda prompt, client, **kwargs: f"Answer to {prompt}"
+        stdin = io.StringIO("first\n\nsecond\n")
+        with patch('sys.argv', ['llm_api.py', '--repl', '--provider', 'anthropic']), \
+             patch('sys.stdin', stdin), \
+             patch('sys.stdout', new_callable=io.StringIO) as mock_stdout:
+            main()
+        self.assertEqual(mock_stdout.getvalue(), "Answer to first\nAnswer to second\n")
+        mock_create_client.assert_called_once_with("anthropic")
+        self.assertEqual(mock_query.call_count, 2)
+        for call in mock_query.call_args_list:
+            self.assertIs(call[0][1], mock_create_client.return_value)
+
+    def test_prompt_required_without_repl(self):
+        with patch('sys.argv', ['llm_api.py']), patch('sys.stderr', new_callable=io.StringIO):
+            with self.assertRaises(SystemExit):
+                main()
 
 if __name__ == '__main__':
     unittest.main()
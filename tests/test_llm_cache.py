@@ -0,0 +1,242 @@
+import unittest
+from unittest.mock import patch
+import io
+import os
+import tempfile
+import time
+from tools import llm_cache
+from tools.llm_cache import ResponseCache, SemanticCache, get_response_cache, get_semantic_cache, make_cache_key
+
+class TestMakeCacheKey(unittest.TestCase):
+    def test_key_is_deterministic(self):
+        self.assertEqual(
+            make_cache_key("openai", "gpt-4o", "Test prompt"),
+            make_cache_key("openai", "gpt-4o", "Test prompt")
+        )
+
+    def test_key_depends_on_request(self):
+        base = make_cache_key("openai", "gpt-4o", "Test prompt")
+        self.assertNotEqual(base, make_cache_key("anthropic", "gpt-4o", "Test prompt"))
+        self.assertNotEqual(base, make_cache_key("openai", "gpt-4o-mini", "Test prompt"))
+        self.assertNotEqual(base, make_cache_key("openai", "gpt-4o", "Other prompt"))
+
+    def test_key_does_not_read_image(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            image_path = os.path.join(tmpdir, "image.png")
+            with open(image_path, "wb") as f:
+                f.write(b"image")
+            with patch('builtins.open') as mock_file_open:
+                make_cache_key("openai", "gpt-4o", "Test prompt", image_path)
+            mock_file_open.assert_not_called()
+
+    def test_key_depends_on_image_file(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            image_path = os.path.join(tmpdir, "image.png")
+            with open(image_path, "wb") as f:
+                f.write(b"first")
+            first = make_cache_key("openai", "gpt-4o", "Test prompt", image_path)
+            with open(image_path, "wb") as f:
+                f.write(b"second")
+            second = make_cache_key("openai", "gpt-4o", "Test prompt", image_path)
+        self.assertNotEqual(first, second)
+        self.assertNotEqual(first, make_cache_key("openai", "gpt-4o", "Test prompt"))
+
+class TestResponseCache(unittest.TestCase):
+    def test_get_missing(self):
+        cache = ResponseCache()
+        self.assertIsNone(cache.get("missing"))
+
+    def test_set_and_get(self):
+        cache = ResponseCache()
+        cache.set("key", "value")
+        self.assertEqual(cache.get("key"), "value")
+
+    def test_set_many(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, "responses.sqlite")
+            ResponseCache(path).set_many([("a", "1"), ("b", "2")])
+            cache = ResponseCache(path)
+            self.assertEqual(cache.get("a"), "1")
+            self.assertEqual(cache.get("b"), "2")
+
+    def test_expiry(self):
+        cache = ResponseCache()
+        with patch('tools.llm_cache.time.time', return_value=1000.0):
+            cache.set("key", "value", expire=10)
+        with patch('tools.llm_cache.time.time', return_value=1011.0):
+            self.assertIsNone(cache.get("key"))
+
+    def test_lru_eviction(self):
+        cache = ResponseCache(maxsize=2)
+        cache.set("a", "1")
+        cache.set("b", "2")
+        cache.get("a")
+        cache.set("c", "3")
+        self.assertEqual(cache.get("a"), "1")
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(cache.get("c"), "3")
+
+    def test_expired_entries_skipped(self):
+        cache = SemanticCache()
+        cache.add("openai:gpt-4o", [1.0, 0.0], "Paris", expire=60)
+        cache.add("openai:gpt-4o", [0.0, 1.0], "Berlin", expire=None)
+        with patch('tools.llm_cache.time.time', return_value=time.time() + 120):
+            self.assertIsNone(cache.lookup("openai:gpt-4o", [1.0, 0.0]))
+            self.assertEqual(cache.lookup("openai:gpt-4o", [0.0, 1.0]), "Berlin")
+
+    def test_grows_past_initial_block(self):
+        cache = SemanticCache()
+        for i in range(40):
+            cache.add("openai:gpt-4o", [1.0 if j == i else 0.0 for j in range(40)], f"Answer {i}")
+        self.assertEqual(cache.lookup("openai:gpt-4o", [1.0 if j == 3 else 0.0 for j in range(40)]), "Answer 3")
+        self.assertEqual(cache.lookup("openai:gpt-4o", [1.0 if j == 39 else 0.0 for j in range(40)]), "Answer 39")
+
+    def test_oldest_entry_replaced_when_full(self):
+        cache = SemanticCache(maxsize=2)
+        cache.add("openai:gpt-4o", [1.0, 0.0, 0.0], "Paris")
+        cache.add("openai:gpt-4o", [0.0, 1.0, 0.0], "Berlin")
+        cache.add("openai:gpt-4o", [0.0, 0.0, 1.0], "Rome")
+        self.assertIsNone(cache.lookup("openai:gpt-4o", [1.0, 0.0, 0.0]))
+        self.assertEqual(cache.lookup("openai:gpt-4o", [0.0, 1.0, 0.0]), "Berlin")
+        self.assertEqual(cache.lookup("openai:gpt-4o", [0.0, 0.0, 1.0]), "Rome")
+
+    def test_persists_to_disk(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, "cache", "responses.sqlite")
+            ResponseCache(path).set("key", "value")
+            self.assertEqual(ResponseCache(path).get("key"), "value")
+
+    def test_clear(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, "responses.sqlite")
+            cache = ResponseCache(path)
+            cache.set("key", "value")
+            cache.clear()
+            self.assertIsNone(cache.get("key"))
+            self.assertIsNone(ResponseCache(path).get("key"))
+
+class TestGetResponseCache(unittest.TestCase):
+    def setUp(self):
+        llm_cache._response_cache = None
+
+    def tearDown(self):
+        llm_cache._response_cache = None
+
+    def test_memory_only_by_default(self):
+        with patch.dict('os.environ', {}, clear=True):
+            cache = get_response_cache()
+        self.assertIsNone(cache._db)
+        self.assertIs(get_response_cache(), cache)
+
+    def test_disk_cache_opt_in(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, "responses.sqlite")
+            with patch.dict('os.environ', {'LLM_CACHE_PATH': path}):
+                get_response_cache().set("key", "value")
+            self.assertEqual(ResponseCache(path).get("key"), "value")
+
+class TestGetSemanticCache(unittest.TestCase):
+    def setUp(self):
+        llm_cache._semantic_cache = None
+
+    def tearDown(self):
+        llm_cache._semantic_cache = None
+
+    def test_memory_only_by_default(self):
+        with patch.dict('os.environ', {}, clear=True):
+            cache = get_semantic_cache()
+        self.assertIsNone(cache.path)
+        self.assertIs(get_semantic_cache(), cache)
+
+class TestSemanticCache(unittest.TestCase):
+    def test_lookup_empty(self):
+        cache = SemanticCache()
+        self.assertIsNone(cache.lookup("openai:gpt-4o", [1.0, 0.0]))
+
+    def test_similar_prompt_hits(self):
+        cache = SemanticCache()
+        cache.add("openai:gpt-4o", [1.0, 0.0, 0.0], "Paris")
+        cache.add("openai:gpt-4o", [0.0, 1.0, 0.0], "Berlin")
+        self.assertEqual(cache.lookup("openai:gpt-4o", [0.99, 0.05, 0.0]), "Paris")
+        self.assertEqual(cache.lookup("openai:gpt-4o", [0.05, 0.99, 0.0]), "Berlin")
+
+    def test_dissimilar_prompt_misses(self):
+        cache = SemanticCache()
+        cache.add("openai:gpt-4o", [1.0, 0.0, 0.0], "Paris")
+        self.assertIsNone(cache.lookup("openai:gpt-4o", [0.7, 0.7, 0.0]))
+
+    def test_namespaces_are_separate(self):
+        cache = SemanticCache()
+        cache.add("openai:gpt-4o", [1.0, 0.0], "Paris")
+        self.assertIsNone(cache.lookup("anthropic:claude-3-sonnet-20240229", [1.0, 0.0]))
+
+    def test_expired_entries_skipped(self):
+        cache = SemanticCache()
+        cache.add("openai:gpt-4o", [1.0, 0.0], "Paris", expire=60)
+        cache.add("openai:gpt-4o", [0.0, 1.0], "Berlin", expire=None)
+        with patch('tools.llm_cache.time.time', return_value=time.time() + 120):
+            self.assertIsNone(cache.lookup("openai:gpt-4o", [1.0, 0.0]))
+            self.assertEqual(cache.lookup("openai:gpt-4o", [0.0, 1.0]), "Berlin")
+
+    def test_grows_past_initial_block(self):
+        cache = SemanticCache()
+        for i in range(40):
+            cache.add("openai:gpt-4o", [1.0 if j == i else 0.0 for j in range(40)], f"Answer {i}")
+        self.assertEqual(cache.lookup("openai:gpt-4o", [1.0 if j == 3 else 0.0 for j in range(40)]), "Answer 3")
+        self.assertEqual(cache.lookup("openai:gpt-4o", [1.0 if j == 39 else 0.0 for j in range(40)]), "Answer 39")
+
+    def test_oldest_entry_replaced_when_full(self):
+        cache = SemanticCache(maxsize=2)
+        cache.add("openai:gpt-4o", [1.0, 0.0, 0.0], "Paris")
+        cache.add("openai:gpt-4o", [0.0, 1.0, 0.0], "Berlin")
+        cache.add("openai:gpt-4o", [0.0, 0.0, 1.0], "Rome")
+        self.assertIsNone(cache.lookup("openai:gpt-4o", [1.0, 0.0, 0.0]))
+        self.assertEqual(cache.lookup("openai:gpt-4o", [0.0, 1.0, 0.0]), "Berlin")
+        self.assertEqual(cache.lookup("openai:gpt-4o", [0.0, 0.0, 1.0]), "Rome")
+
+    def test_persists_to_disk(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, "semantic.npz")
+            cache = SemanticCache(path)
+            cache.add("openai:gpt-4o", [1.0, 0.0], "Paris")
+            cache.add("openai:gpt-4o", [0.0, 1.0], "Berlin " * 1000)
+            cache.flush()
+            reloaded = SemanticCache(path)
+            self.assertEqual(reloaded.lookup("openai:gpt-4o", [1.0, 0.0]), "Paris")
+            self.assertEqual(reloaded.lookup("openai:gpt-4o", [0.0, 1.0]), "Berlin " * 1000)
+
+    def test_reload_keeps_newest_unexpired(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, "semantic.npz")
+            cache = SemanticCache(path, maxsize=2)
+            cache.add("openai:gpt-4o", [1.0, 0.0, 0.0], "Paris")
+            cache.add("openai:gpt-4o", [0.0, 1.0, 0.0], "Berlin", expire=60)
+            cache.add("openai:gpt-4o", [0.0, 0.0, 1.0], "Rome")
+            cache.flush()
+            with patch('tools.llm_cache.time.time', return_value=time.time() + 120):
+                reloaded = SemanticCache(path, maxsize=2)
+            self.assertEqual(reloaded._size, 1)
+            self.assertEqual(reloaded.lookup("openai:gpt-4o", [0.0, 0.0, 1.0]), "Rome")
+
+    def test_saves_in_batches(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, "semantic.npz")
+            cache = SemanticCache(path, save_every=2)
+            cache.add("openai:gpt-4o", [1.0, 0.0], "Paris")
+            self.assertFalse(os.path.exists(path))
+            cache.add("openai:gpt-4o", [0.0, 1.0], "Berlin")
+            self.assertEqual(SemanticCache(path).lookup("openai:gpt-4o", [0.0, 1.0]), "Berlin")
+
+    def test_mismatched_files_are_discarded(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, "semantic.npz")
+            cache = SemanticCache(path)
+            cache.add("openai:gpt-4o", [1.0, 0.0], "Paris")
+            cache.flush()
+            with open(os.path.join(tmpdir, "semantic.json"), "w") as f:
+                f.write('{"namespaces": [], "responses": []}')
+            with patch('sys.stderr', new_callable=io.StringIO):
+                self.assertIsNone(SemanticCache(path).lookup("openai:gpt-4o", [1.0, 0.0]))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,151 @@
+import unittest
+from unittest.mock import patch, MagicMock, AsyncMock
+import os
+from tools import rate_limiter
+from tools.rate_limiter import RateLimiter, estimate_tokens, get_rate_limiter
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+        self.sleeps = []
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+class TestRateLimiter(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.monotonic_patcher = patch('tools.rate_limiter.time.monotonic', side_effect=self.clock.monotonic)
+        self.sleep_patcher = patch('tools.rate_limiter.time.sleep', side_effect=self.clock.sleep)
+        self.monotonic_patcher.start()
+        self.sleep_patcher.start()
+
+    def tearDown(self):
+        self.monotonic_patcher.stop()
+        self.sleep_patcher.stop()
+
+    def test_unlimited(self):
+        limiter = RateLimiter()
+        for _ in range(100):
+            limiter.acquire(10000)
+        self.assertEqual(self.clock.sleeps, [])
+
+    def test_limits_tokens(self):
+        self.assertFalse(RateLimiter(rpm=60).limits_tokens)
+        self.assertTrue(RateLimiter(tpm=6000).limits_tokens)
+
+    def test_requests_per_minute(self):
+        limiter = RateLimiter(rpm=60)
+        for _ in range(60):
+            limiter.acquire()
+        self.assertEqual(self.clock.sleeps, [])
+        # The bucket is empty; one request refills every second
+        limiter.acquire()
+        self.assertEqual(len(self.clock.sleeps), 1)
+        self.assertAlmostEqual(self.clock.sleeps[0], 1.0)
+
+    def test_tokens_per_minute(self):
+        limiter = RateLimiter(tpm=6000)
+        limiter.acquire(6000)
+        limiter.acquire(3000)
+        self.assertAlmostEqual(self.clock.sleeps[-1], 30.0)
+
+    def test_oversized_request_capped_at_capacity(self):
+        limiter = RateLimiter(tpm=6000)
+        self.assertEqual(limiter.acquire(100000), 6000)
+        self.assertEqual(self.clock.sleeps, [])
+        limiter.acquire(6000)
+        self.assertAlmostEqual(self.clock.sleeps[-1], 60.0)
+
+class TestRecordUsage(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.monotonic_patcher = patch('tools.rate_limiter.time.monotonic', side_effect=self.clock.monotonic)
+        self.sleep_patcher = patch('tools.rate_limiter.time.sleep', side_effect=self.clock.sleep)
+        self.monotonic_patcher.start()
+        self.sleep_patcher.start()
+
+    def tearDown(self):
+        self.monotonic_patcher.stop()
+        self.sleep_patcher.stop()
+
+    def test_unused_tokens_are_returned(self):
+        limiter = RateLimiter(tpm=6000)
+        limiter.acquire(6000)
+        limiter.record_usage(6000, 1000)
+        limiter.acquire(5000)
+        self.assertEqual(self.clock.sleeps, [])
+
+    def test_extra_tokens_delay_next_request(self):
+        limiter = RateLimiter(tpm=6000)
+        limiter.acquire(3000)
+        limiter.record_usage(3000, 6000)
+        limiter.acquire(600)
+        self.assertAlmostEqual(self.clock.sleeps[-1], 6.0)
+
+    def test_oversized_request_settles_against_reservation(self):
+        limiter = RateLimiter(tpm=6000)
+        reserved = limiter.acquire(100000)
+        limiter.record_usage(reserved, 6000)
+        self.assertEqual(limiter._tokens.level, 0)
+
+    def test_unknown_usage_is_ignored(self):
+        limiter = RateLimiter(tpm=6000)
+        limiter.acquire(6000)
+        limiter.record_usage(6000, None)
+        self.assertEqual(limiter._tokens.level, 0)
+
+class TestAsyncRateLimiter(unittest.IsolatedAsyncioTestCase):
+    async def test_aacquire_waits(self):
+        # Patch the module's asyncio reference only, not the event loop's sleep
+        mock_asyncio = MagicMock(sleep=AsyncMock())
+        with patch('tools.rate_limiter.time.monotonic', return_value=1000.0), \
+             patch('tools.rate_limiter.asyncio', mock_asyncio):
+            limiter = RateLimiter(rpm=60)
+            for _ in range(61):
+                await limiter.aacquire()
+        mock_asyncio.sleep.assert_awaited_once()
+        self.assertAlmostEqual(mock_asyncio.sleep.await_args[0][0], 1.0)
+
+class TestEstimateTokens(unittest.TestCase):
+    def test_fallback_estimate(self):
+        with patch('tools.rate_limiter.tiktoken', None):
+            self.assertEqual(estimate_tokens("a" * 400, "gpt-4o"), 100)
+
+    def test_fallback_when_encoding_unavailable(self):
+        mock_tiktoken = MagicMock()
+        mock_tiktoken.encoding_for_model.side_effect = ConnectionError("download failed")
+        with patch('tools.rate_limiter.tiktoken', mock_tiktoken):
+            self.assertEqual(estimate_tokens("a" * 400, "gpt-4o"), 100)
+
+class TestGetRateLimiter(unittest.TestCase):
+    def setUp(self):
+        rate_limiter._rate_limiters.clear()
+
+    def tearDown(self):
+        rate_limiter._rate_limiters.clear()
+
+    def test_same_limiter_per_provider(self):
+        self.assertIs(get_rate_limiter("openai"), get_rate_limiter("openai"))
+        self.assertIsNot(get_rate_limiter("openai"), get_rate_limiter("anthropic"))
+
+    def test_limits_from_env(self):
+        with patch.dict('os.environ', {'OPENAI_RATE_LIMIT_RPM': '10', 'OPENAI_RATE_LIMIT_TPM': '0'}):
+            limiter = get_rate_limiter("openai")
+        self.assertEqual(limiter._requests.capacity, 10)
+        self.assertIsNone(limiter._tokens)
+
+    def test_unlimited_unless_configured(self):
+        with patch.dict('os.environ'):
+            for name in ['OPENAI_RATE_LIMIT_RPM', 'OPENAI_RATE_LIMIT_TPM']:
+                os.environ.pop(name, None)
+            limiter = get_rate_limiter("openai")
+        self.assertIsNone(limiter._requests)
+        self.assertIsNone(limiter._tokens)
+
+if __name__ == '__main__':
+    unittest.main()
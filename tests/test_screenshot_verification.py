@@ -5,8 +5,15 @@ import pytest
 from unittest.mock import patch, MagicMock, mock_open, AsyncMock
 from tools.screenshot_utils import take_screenshot_sync, take_screenshot
 from tools.llm_api import query_llm
+from tools.llm_cache import ResponseCache
 
 class TestScreenshotVerification:
+    @pytest.fixture(autouse=True)
+    def fresh_response_cache(self):
+        """Keep responses cached by other tests or runs from answering these queries."""
+        with patch('tools.llm_api.get_response_cache', return_value=ResponseCache()):
+            yield
+    
     @pytest.fixture
     def mock_page(self):
         """Mock Playwright page object."""
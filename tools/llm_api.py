@@ -1,19 +1,47 @@
 #!/usr/bin/env /workspace/tmp_windsurf/venv/bin/python3
 
 import google.generativeai as genai
-from openai import OpenAI, AzureOpenAI
-from anthropic import Anthropic
+from google.api_core import exceptions as google_exceptions
+import openai
+import anthropic
+from openai import OpenAI, AzureOpenAI, AsyncOpenAI, AsyncAzureOpenAI
+from anthropic import Anthropic, AsyncAnthropic
 import argparse
+import asyncio
 import os
-from dotenv import load_dotenv
+from dotenv import load_dotenv, dotenv_values
 from pathlib import Path
 import sys
+import time
+import random
 import base64
-from typing import Optional, Union, List
+from typing import Optional, Union, List, Any, Iterator
 import mimetypes
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor, Future
+import atexit
+import hashlib
 
+try:
+    from tools.llm_cache import get_response_cache, get_semantic_cache, make_cache_key
+    from tools.rate_limiter import get_rate_limiter, estimate_tokens
+except ImportError:  # Run as a script from inside tools/
+    from llm_cache import get_response_cache, get_semantic_cache, make_cache_key
+    from rate_limiter import get_rate_limiter, estimate_tokens
+
+def _debug(*args):
+    """Print a diagnostic message to stderr when LLM_API_DEBUG is set"""
+    if os.environ.get("LLM_API_DEBUG"):
+        print(*args, file=sys.stderr)
+
+@lru_cache(maxsize=1)
 def load_environment():
-    """Load environment variables from .env files in order of precedence"""
+    """
+    Load environment variables from .env files in order of precedence.
+    
+    Runs once per process, on the first client creation or from main(). Set
+    LLM_API_DEBUG to print which files and keys were loaded.
+    """
     # Order of precedence:
     # 1. System environment variables (already loaded)
     # 2. .env.local (user-specific overrides)
@@ -23,87 +51,208 @@ def load_environment():
     env_files = ['.env.local', '.env', '.env.example']
     env_loaded = False
     
-    print("Current working directory:", Path('.').absolute(), file=sys.stderr)
-    print("Looking for environment files:", env_files, file=sys.stderr)
+    _debug("Current working directory:", Path('.').absolute())
+    _debug("Looking for environment files:", env_files)
     
     for env_file in env_files:
         env_path = Path('.') / env_file
-        print(f"Checking {env_path.absolute()}", file=sys.stderr)
+        _debug(f"Checking {env_path.absolute()}")
         if env_path.exists():
-            print(f"Found {env_file}, loading variables...", file=sys.stderr)
+            _debug(f"Found {env_file}, loading variables...")
             load_dotenv(dotenv_path=env_path)
             env_loaded = True
-            print(f"Loaded environment variables from {env_file}", file=sys.stderr)
+            _debug(f"Loaded environment variables from {env_file}")
             # Print loaded keys (but not values for security)
-            with open(env_path) as f:
-                keys = [line.split('=')[0].strip() for line in f if '=' in line and not line.startswith('#')]
-                print(f"Keys loaded from {env_file}: {keys}", file=sys.stderr)
+            if os.environ.get("LLM_API_DEBUG"):
+                keys = list(dotenv_values(env_path).keys())
+                _debug(f"Keys loaded from {env_file}: {keys}")
     
     if not env_loaded:
         print("Warning: No .env files found. Using system environment variables only.", file=sys.stderr)
-        print("Available system environment variables:", list(os.environ.keys()), file=sys.stderr)
+        _debug("Available system environment variables:", list(os.environ.keys()))
 
-# Load environment variables at module import
-load_environment()
+# Bytes read per base64 chunk in encode_image_file; must be a multiple of 3
+IMAGE_ENCODE_CHUNK_SIZE = 57 * 1024
 
 def encode_image_file(image_path: str) -> tuple[str, str]:
     """
     Encode an image file to base64 and determine its MIME type.
     
+    Results are cached by path, modification time and size, so repeated queries
+    with an unchanged image skip re-reading and re-encoding it.
+    
     Args:
         image_path (str): Path to the image file
         
     Returns:
         tuple: (base64_encoded_string, mime_type)
     """
+    path = os.path.abspath(image_path)
+    stat = os.stat(path)
+    return _encode_image_cached(path, stat.st_mtime_ns, stat.st_size)
+
+@lru_cache(maxsize=64)
+def _encode_image_cached(image_path: str, mtime_ns: int, size: int) -> tuple[str, str]:
     mime_type, _ = mimetypes.guess_type(image_path)
     if not mime_type:
         mime_type = 'image/png'  # Default to PNG if type cannot be determined
         
+    # Encode in chunks whose size is a multiple of 3 bytes so no padding lands mid-stream,
+    # instead of holding the whole raw file alongside its encoding
+    encoded = bytearray()
     with open(image_path, "rb") as image_file:
-        encoded_string = base64.b64encode(image_file.read()).decode('utf-8')
+        while chunk := image_file.read(IMAGE_ENCODE_CHUNK_SIZE):
+            encoded.extend(base64.b64encode(chunk))
         
-    return encoded_string, mime_type
+    return encoded.decode('ascii'), mime_type
+
+# Environment variable holding the API key for each provider
+API_KEY_ENV_VARS = {
+    "openai": "OPENAI_API_KEY",
+    "azure": "AZURE_OPENAI_API_KEY",
+    "deepseek": "DEEPSEEK_API_KEY",
+    "siliconflow": "SILICONFLOW_API_KEY",
+    "anthropic": "ANTHROPIC_API_KEY",
+    "gemini": "GOOGLE_API_KEY",
+}
+
+# Connection pool limits for each SDK client's HTTP client
+HTTP_LIMITS = dict(
+    max_keepalive_connections=20,
+    max_connections=100,
+    keepalive_expiry=30.0,
+)
+
+# Seconds to wait for a response, and for a connection to open
+HTTP_TIMEOUT = 600.0
+HTTP_CONNECT_TIMEOUT = 5.0
+
+# Clients keyed by (provider, api key hash) so repeated calls reuse connections
+_CLIENT_CACHE: dict[tuple[str, str], Any] = {}
+
+def _close_cached_clients():
+    """Close all cached clients and empty the cache"""
+    for client in _CLIENT_CACHE.values():
+        if hasattr(client, "close"):
+            try:
+                client.close()
+            except Exception:
+                pass
+    _CLIENT_CACHE.clear()
+    _GEMINI_MODELS.clear()
+
+atexit.register(_close_cached_clients)
+
+def _api_key_hash(provider: str) -> str:
+    """SHA-256 of the provider's current API key, so caches never hold the key itself"""
+    api_key = os.getenv(API_KEY_ENV_VARS.get(provider, ""), "")
+    return hashlib.sha256(api_key.encode()).hexdigest()
 
 def create_llm_client(provider="openai"):
+    """
+    Return a client for the given provider, reusing a cached instance if one exists.
+    
+    Clients are cached per provider and API key, so a rotated key yields a new client.
+    
+    Args:
+        provider (str): The API provider to use
+        
+    Returns:
+        The LLM client instance
+    """
+    load_environment()
+    cache_key = (provider, _api_key_hash(provider))
+    client = _CLIENT_CACHE.get(cache_key)
+    if client is None:
+        client = _new_llm_client(provider)
+        _CLIENT_CACHE[cache_key] = client
+    return client
+
+def create_async_llm_client(provider="openai"):
+    """
+    Create an async client for the given provider.
+    
+    Async clients are not cached: their connection pool is bound to the event loop
+    that first uses it, so the caller owns the client and should close it when done.
+    
+    Args:
+        provider (str): The API provider to use
+        
+    Returns:
+        The async LLM client instance
+    """
+    load_environment()
+    return _new_llm_client(provider, asynchronous=True)
+
+def _new_http_client(sdk, asynchronous=False):
+    """
+    Create the pooled HTTP client for one SDK client.
+    
+    Built from the SDK module's own client classes and types (openai or anthropic),
+    since an SDK rejects clients from a different httpx package than the one it uses.
+    Each SDK client owns its pool, since closing the SDK client also closes it.
+    """
+    limits = type(sdk.DEFAULT_CONNECTION_LIMITS)(**HTTP_LIMITS)
+    timeout = sdk.Timeout(HTTP_TIMEOUT, connect=HTTP_CONNECT_TIMEOUT)
+    client_cls = sdk.DefaultAsyncHttpxClient if asynchronous else sdk.DefaultHttpxClient
+    return client_cls(limits=limits, timeout=timeout)
+
+def _new_llm_client(provider="openai", asynchronous=False):
+    # SDK retries are disabled: _with_retries is the single retry layer, otherwise
+    # each of its attempts would be retried again inside the SDK
+    if asynchronous:
+        openai_cls, azure_cls, anthropic_cls = AsyncOpenAI, AsyncAzureOpenAI, AsyncAnthropic
+    else:
+        openai_cls, azure_cls, anthropic_cls = OpenAI, AzureOpenAI, Anthropic
+
     if provider == "openai":
         api_key = os.getenv('OPENAI_API_KEY')
         if not api_key:
             raise ValueError("OPENAI_API_KEY not found in environment variables")
-        return OpenAI(
-            api_key=api_key
+        return openai_cls(
+            api_key=api_key,
+            max_retries=0,
+            http_client=_new_http_client(openai, asynchronous)
         )
     elif provider == "azure":
         api_key = os.getenv('AZURE_OPENAI_API_KEY')
         if not api_key:
             raise ValueError("AZURE_OPENAI_API_KEY not found in environment variables")
-        return AzureOpenAI(
+        return azure_cls(
             api_key=api_key,
             api_version="2024-08-01-preview",
-            azure_endpoint="https://msopenai.openai.azure.com"
+            azure_endpoint="https://msopenai.openai.azure.com",
+            max_retries=0,
+            http_client=_new_http_client(openai, asynchronous)
         )
     elif provider == "deepseek":
         api_key = os.getenv('DEEPSEEK_API_KEY')
         if not api_key:
             raise ValueError("DEEPSEEK_API_KEY not found in environment variables")
-        return OpenAI(
+        return openai_cls(
             api_key=api_key,
             base_url="https://api.deepseek.com/v1",
+            max_retries=0,
+            http_client=_new_http_client(openai, asynchronous)
         )
     elif provider == "siliconflow":
         api_key = os.getenv('SILICONFLOW_API_KEY')
         if not api_key:
             raise ValueError("SILICONFLOW_API_KEY not found in environment variables")
-        return OpenAI(
+        return openai_cls(
             api_key=api_key,
-            base_url="https://api.siliconflow.cn/v1"
+            base_url="https://api.siliconflow.cn/v1",
+            max_retries=0,
+            http_client=_new_http_client(openai, asynchronous)
         )
     elif provider == "anthropic":
         api_key = os.getenv('ANTHROPIC_API_KEY')
         if not api_key:
             raise ValueError("ANTHROPIC_API_KEY not found in environment variables")
-        return Anthropic(
-            api_key=api_key
+        return anthropic_cls(
+            api_key=api_key,
+            max_retries=0,
+            http_client=_new_http_client(anthropic, asynchronous)
         )
     elif provider == "gemini":
         api_key = os.getenv('GOOGLE_API_KEY')
@@ -112,161 +261,672 @@ def create_llm_client(provider="openai"):
         genai.configure(api_key=api_key)
         return genai
     elif provider == "local":
-        return OpenAI(
+        return openai_cls(
             base_url="http://192.168.180.137:8006/v1",
-            api_key="not-needed"
+            api_key="not-needed",
+            max_retries=0,
+            http_client=_new_http_client(openai, asynchronous)
         )
     else:
         raise ValueError(f"Unsupported provider: {provider}")
 
-def query_llm(prompt: str, client=None, model=None, provider="openai", image_path: Optional[str] = None) -> Optional[str]:
+# Transient errors worth retrying: rate limits, dropped connections and 5xx responses
+RETRYABLE_ERRORS = (
+    openai.RateLimitError,
+    openai.APIConnectionError,
+    openai.InternalServerError,
+    anthropic.RateLimitError,
+    anthropic.APIConnectionError,
+    anthropic.InternalServerError,
+    # 529 overloaded: not an InternalServerError, and missing from older SDKs
+    getattr(anthropic, "OverloadedError", anthropic.InternalServerError),
+    google_exceptions.ResourceExhausted,
+    google_exceptions.ServiceUnavailable,
+    google_exceptions.InternalServerError,
+)
+
+# Attempts per API call before giving up on a transient error
+MAX_ATTEMPTS = 3
+
+def _retry_delay(attempt: int) -> float:
+    """Exponential backoff with jitter: 1-2s, then 2-3s, ..."""
+    return (2 ** attempt) + random.random()
+
+def _with_retries(call):
+    """Run call(), retrying transient API errors with exponential backoff"""
+    for attempt in range(MAX_ATTEMPTS):
+        try:
+            return call()
+        except RETRYABLE_ERRORS as e:
+            if attempt == MAX_ATTEMPTS - 1:
+                raise
+            delay = _retry_delay(attempt)
+            print(f"Attempt {attempt + 1}/{MAX_ATTEMPTS} failed: {e}; retrying in {delay:.1f}s", file=sys.stderr)
+            time.sleep(delay)
+
+async def _awith_retries(call):
+    """Await call(), retrying transient API errors with exponential backoff"""
+    for attempt in range(MAX_ATTEMPTS):
+        try:
+            return await call()
+        except RETRYABLE_ERRORS as e:
+            if attempt == MAX_ATTEMPTS - 1:
+                raise
+            delay = _retry_delay(attempt)
+            print(f"Attempt {attempt + 1}/{MAX_ATTEMPTS} failed: {e}; retrying in {delay:.1f}s", file=sys.stderr)
+            await asyncio.sleep(delay)
+
+# Default model per provider; Azure uses its deployment name from the environment
+DEFAULT_MODELS = {
+    "openai": "gpt-4o",
+    "deepseek": "deepseek-chat",
+    "siliconflow": "deepseek-ai/DeepSeek-R1",
+    "anthropic": "claude-3-5-sonnet-20241022",
+    "gemini": "gemini-pro",
+    "local": "Qwen/Qwen2.5-32B-Instruct-AWQ",
+}
+
+def _default_model(provider: str) -> Optional[str]:
+    """Return the default model for a provider"""
+    if provider == "azure":
+        return os.getenv('AZURE_OPENAI_MODEL_DEPLOYMENT', 'gpt-4o-ms')  # Get from env with fallback
+    return DEFAULT_MODELS.get(provider)
+
+def _openai_request_kwargs(prompt: str, model: str, provider: str, image: Optional[tuple[str, str]] = None, temperature: Optional[float] = None) -> dict:
+    """Build the chat.completions.create arguments for OpenAI-compatible providers from an encode_image_file result"""
+    content = [{"type": "text", "text": prompt}]
+    
+    # Add image content if provided; only OpenAI itself accepts images here
+    if image and provider == "openai":
+        encoded_image, mime_type = image
+        content.append({"type": "image_url", "image_url": {"url": f"data:{mime_type};base64,{encoded_image}"}})
+    
+    messages = [{"role": "user", "content": content}]
+    
+    kwargs = {
+        "model": model,
+        "messages": messages,
+        "temperature": 0.7 if temperature is None else temperature,
+    }
+    
+    # Add o1-specific parameters
+    if model == "o1":
+        kwargs["response_format"] = {"type": "text"}
+        kwargs["reasoning_effort"] = "low"
+        del kwargs["temperature"]
+    
+    return kwargs
+
+def _anthropic_messages(prompt: str, image: Optional[tuple[str, str]] = None) -> list:
+    """Build the messages list for the Anthropic API from an encode_image_file result"""
+    messages = [{"role": "user", "content": []}]
+    
+    # Add text content
+    messages[0]["content"].append({
+        "type": "text",
+        "text": prompt
+    })
+    
+    # Add image content if provided
+    if image:
+        encoded_image, mime_type = image
+        messages[0]["content"].append({
+            "type": "image",
+            "source": {
+                "type": "base64",
+                "media_type": mime_type,
+                "data": encoded_image
+            }
+        })
+    
+    return messages
+
+def _anthropic_request_kwargs(prompt: str, model: str, image: Optional[tuple[str, str]] = None, temperature: Optional[float] = None) -> dict:
+    """Build the messages.create arguments for Anthropic from an encode_image_file result"""
+    kwargs = {
+        "model": model,
+        "max_tokens": 1000,
+        "messages": _anthropic_messages(prompt, image),
+    }
+    if temperature is not None:
+        kwargs["temperature"] = temperature
+    return kwargs
+
+# Background threads for file I/O that can overlap with request setup
+_IO_POOL = ThreadPoolExecutor(max_workers=4, thread_name_prefix="llm_api_io")
+
+def _start_image_encoding(provider: str, image_path: Optional[str]) -> Optional[Future]:
+    """Start encoding an image in the background if the provider sends it inline"""
+    if image_path and provider in ["openai", "anthropic"]:
+        return _IO_POOL.submit(encode_image_file, image_path)
+    return None
+
+# Gemini models keyed by (api key hash, model name), reused across calls instead of
+# being rebuilt per request; a model keeps the key genai was configured with when it was created
+_GEMINI_MODELS: dict[tuple[str, str], Any] = {}
+
+def _gemini_model(client, model: str):
+    """Return the cached GenerativeModel for a model name and the current API key, creating it on first use"""
+    cache_key = (_api_key_hash("gemini"), model)
+    gemini_model = _GEMINI_MODELS.get(cache_key)
+    if gemini_model is None:
+        gemini_model = _GEMINI_MODELS.setdefault(cache_key, client.GenerativeModel(model))
+    return gemini_model
+
+def _gemini_history(prompt: str, image_path: Optional[str] = None) -> list:
+    """Build the chat history for a Gemini chat session"""
+    if image_path:
+        file = genai.upload_file(image_path, mime_type="image/png")
+        return [{"role": "user", "parts": [file, prompt]}]
+    return [{"role": "user", "parts": [prompt]}]
+
+def _gemini_send_kwargs(temperature: Optional[float] = None) -> dict:
+    """Build the send_message arguments for a Gemini chat session"""
+    if temperature is None:
+        return {}
+    return {"generation_config": {"temperature": temperature}}
+
+# Completion tokens reserved per request when pacing against tokens-per-minute limits
+COMPLETION_TOKEN_ESTIMATE = 1000
+
+def _estimated_request_tokens(limiter, prompt: str, model: Optional[str]) -> int:
+    """Estimate the tokens a request counts against the provider's rate limit; 0 if the limiter has no token limit"""
+    if not limiter.limits_tokens:
+        return 0
+    return estimate_tokens(prompt, model) + COMPLETION_TOKEN_ESTIMATE
+
+def _response_total_tokens(provider: str, response) -> Optional[int]:
+    """Return the total tokens a provider reports for a response, or None if it reports none"""
+    if response is None:
+        return None
+    if provider == "anthropic":
+        usage = getattr(response, "usage", None)
+        input_tokens = getattr(usage, "input_tokens", None)
+        output_tokens = getattr(usage, "output_tokens", None)
+        if isinstance(input_tokens, int) and isinstance(output_tokens, int):
+            return input_tokens + output_tokens
+        return None
+    if provider == "gemini":
+        total = getattr(getattr(response, "usage_metadata", None), "total_token_count", None)
+    else:
+        total = getattr(getattr(response, "usage", None), "total_tokens", None)
+    return total if isinstance(total, int) else None
+
+# Seconds a cached response stays valid
+RESPONSE_CACHE_TTL = 3600
+
+def _response_cache_key(provider: str, model: Optional[str], prompt: str, image_path: Optional[str] = None) -> Optional[str]:
+    """Return the response cache key for a request, or None if it cannot be computed"""
+    try:
+        return make_cache_key(provider, model, prompt, image_path)
+    except OSError:
+        return None
+
+# OpenAI model used to embed prompts for the semantic cache
+SEMANTIC_EMBEDDING_MODEL = "text-embedding-3-small"
+
+def _embed_prompt(prompt: str) -> Optional[list]:
+    """Embed a prompt for the semantic cache, or return None if embedding fails"""
+    try:
+        response = create_llm_client("openai").embeddings.create(model=SEMANTIC_EMBEDDING_MODEL, input=prompt)
+        return response.data[0].embedding
+    except Exception as e:
+        print(f"Warning: semantic cache skipped, could not embed prompt: {e}", file=sys.stderr)
+        return None
+
+def query_llm(prompt: str, client=None, model=None, provider="openai", image_path: Optional[str] = None, no_cache: bool = False, semantic_cache: bool = False, temperature: Optional[float] = None) -> Optional[str]:
     """
     Query an LLM with a prompt and optional image attachment.
     
+    Unsampled requests (temperature=0) identical to an earlier one (same provider,
+    model, prompt and image file) are served from the response cache for
+    RESPONSE_CACHE_TTL seconds. With semantic_cache, a text-only prompt close enough in
+    meaning to an earlier one for the same model reuses that earlier response. Sampled
+    requests always reach the provider, so asking again gives a fresh answer.
+    
     Args:
         prompt (str): The text prompt to send
         client: The LLM client instance
         model (str, optional): The model to use
         provider (str): The API provider to use
         image_path (str, optional): Path to an image file to attach
+        no_cache (bool): Skip the response cache and always query the provider
+        semantic_cache (bool): Also reuse responses to semantically similar prompts
+        temperature (float, optional): Sampling temperature; None uses 0.7 for OpenAI-compatible
+            providers and the SDK default otherwise. Responses are only cached at 0.
         
     Returns:
         Optional[str]: The LLM's response or None if there was an error
     """
+    load_environment()
+    
+    # Set default model
+    if model is None:
+        model = _default_model(provider)
+    
+    # Only unsampled answers are reused: a sampled one may be the bad answer a caller is asking again about
+    use_cache = temperature == 0 and not no_cache
+    response_cache = get_response_cache() if use_cache else None
+    cache_key = _response_cache_key(provider, model, prompt, image_path) if use_cache else None
+    if cache_key:
+        cached = response_cache.get(cache_key)
+        if cached is not None:
+            return cached
+    
+    embedding = None
+    semantic_namespace = f"{provider}:{model}"
+    if semantic_cache and use_cache and not image_path:
+        embedding = _embed_prompt(prompt)
+        if embedding is not None:
+            cached = get_semantic_cache().lookup(semantic_namespace, embedding)
+            if cached is not None:
+                return cached
+    
+    # Cache miss: encode the image while the client and rate limiter are dealt with
+    image_future = _start_image_encoding(provider, image_path)
+    
     if client is None:
         client = create_llm_client(provider)
     
     try:
-        # Set default model
-        if model is None:
-            if provider == "openai":
-                model = "gpt-4o"
-            elif provider == "azure":
-                model = os.getenv('AZURE_OPENAI_MODEL_DEPLOYMENT', 'gpt-4o-ms')  # Get from env with fallback
-            elif provider == "deepseek":
-                model = "deepseek-chat"
-            elif provider == "siliconflow":
-                model = "deepseek-ai/DeepSeek-R1"
-            elif provider == "anthropic":
-                model = "claude-3-sonnet-20240229"
-            elif provider == "gemini":
-                model = "gemini-pro"
-            elif provider == "local":
-                model = "Qwen/Qwen2.5-32B-Instruct-AWQ"
+        limiter = get_rate_limiter(provider)
+        reserved_tokens = limiter.acquire(_estimated_request_tokens(limiter, prompt, model))
         
+        image = image_future.result() if image_future else None
+        result = None
+        response = None
         if provider in ["openai", "local", "deepseek", "azure", "siliconflow"]:
-            messages = [{"role": "user", "content": []}]
-            
-            # Add text content
-            messages[0]["content"].append({
-                "type": "text",
-                "text": prompt
-            })
-            
-            # Add image content if provided
-            if image_path:
-                if provider == "openai":
-                    encoded_image, mime_type = encode_image_file(image_path)
-                    messages[0]["content"] = [
-                        {"type": "text", "text": prompt},
-                        {"type": "image_url", "image_url": {"url": f"data:{mime_type};base64,{encoded_image}"}}
-                    ]
+            kwargs = _openai_request_kwargs(prompt, model, provider, image, temperature)
+            response = _with_retries(lambda: client.chat.completions.create(**kwargs))
+            result = response.choices[0].message.content
             
-            kwargs = {
-                "model": model,
-                "messages": messages,
-                "temperature": 0.7,
-            }
+        elif provider == "anthropic":
+            kwargs = _anthropic_request_kwargs(prompt, model, image, temperature)
+            response = _with_retries(lambda: client.messages.create(**kwargs))
+            result = response.content[0].text
             
-            # Add o1-specific parameters
-            if model == "o1":
-                kwargs["response_format"] = {"type": "text"}
-                kwargs["reasoning_effort"] = "low"
-                del kwargs["temperature"]
+        elif provider == "gemini":
+            model = _gemini_model(client, model)
+            chat_session = model.start_chat(history=_gemini_history(prompt, image_path))
+            kwargs = _gemini_send_kwargs(temperature)
+            response = _with_retries(lambda: chat_session.send_message(prompt, **kwargs))
+            result = response.text
+        
+        # Settle the rate limit reservation against what the provider actually counted
+        limiter.record_usage(reserved_tokens, _response_total_tokens(provider, response))
+        
+        if isinstance(result, str):
+            if cache_key:
+                response_cache.set(cache_key, result, expire=RESPONSE_CACHE_TTL)
+            if embedding is not None:
+                get_semantic_cache().add(semantic_namespace, embedding, result, expire=RESPONSE_CACHE_TTL)
+        return result
             
-            response = client.chat.completions.create(**kwargs)
-            return response.choices[0].message.content
+    except Exception as e:
+        print(f"Error querying LLM: {e}", file=sys.stderr)
+        return None
+
+def query_llm_stream(prompt: str, client=None, model=None, provider="openai", image_path: Optional[str] = None) -> Iterator[str]:
+    """
+    Query an LLM and yield the response text as it arrives.
+    
+    Streaming responses bypass the response caches. Providers report no usage for the
+    stream here, so the rate limit reservation is settled against estimated token
+    counts of the prompt and the text received.
+    
+    Args:
+        prompt (str): The text prompt to send
+        client: The LLM client instance
+        model (str, optional): The model to use
+        provider (str): The API provider to use
+        image_path (str, optional): Path to an image file to attach
+        
+    Yields:
+        str: Successive chunks of the LLM's response; stops early if there was an error
+    """
+    load_environment()
+    
+    # Encode the image while the client and rate limiter are dealt with
+    image_future = _start_image_encoding(provider, image_path)
+    
+    if client is None:
+        client = create_llm_client(provider)
+    
+    received = []
+    reserved_tokens = None
+    try:
+        # Set default model
+        if model is None:
+            model = _default_model(provider)
+        
+        limiter = get_rate_limiter(provider)
+        reserved_tokens = limiter.acquire(_estimated_request_tokens(limiter, prompt, model))
+        
+        image = image_future.result() if image_future else None
+        
+        if provider in ["openai", "local", "deepseek", "azure", "siliconflow"]:
+            kwargs = _openai_request_kwargs(prompt, model, provider, image)
+            for chunk in _with_retries(lambda: client.chat.completions.create(stream=True, **kwargs)):
+                if chunk.choices and chunk.choices[0].delta.content:
+                    received.append(chunk.choices[0].delta.content)
+                    yield chunk.choices[0].delta.content
             
         elif provider == "anthropic":
-            messages = [{"role": "user", "content": []}]
+            with client.messages.stream(
+                model=model,
+                max_tokens=1000,
+                messages=_anthropic_messages(prompt, image)
+            ) as stream:
+                for text in stream.text_stream:
+                    received.append(text)
+                    yield text
             
-            # Add text content
-            messages[0]["content"].append({
-                "type": "text",
-                "text": prompt
-            })
+        elif provider == "gemini":
+            gemini_model = _gemini_model(client, model)
+            chat_session = gemini_model.start_chat(history=_gemini_history(prompt, image_path))
+            for chunk in _with_retries(lambda: chat_session.send_message(prompt, stream=True)):
+                if chunk.text:
+                    received.append(chunk.text)
+                    yield chunk.text
             
-            # Add image content if provided
-            if image_path:
-                encoded_image, mime_type = encode_image_file(image_path)
-                messages[0]["content"].append({
-                    "type": "image",
-                    "source": {
-                        "type": "base64",
-                        "media_type": mime_type,
-                        "data": encoded_image
-                    }
-                })
+    except Exception as e:
+        print(f"Error querying LLM: {e}", file=sys.stderr)
+    finally:
+        # Also runs when the caller stops iterating early
+        if reserved_tokens is not None and limiter.limits_tokens:
+            used = estimate_tokens(prompt, model) + estimate_tokens("".join(received), model)
+            limiter.record_usage(reserved_tokens, used)
+
+async def aquery_llm(prompt: str, client=None, model=None, provider="openai", image_path: Optional[str] = None, no_cache: bool = False, semantic_cache: bool = False, temperature: Optional[float] = None) -> Optional[str]:
+    """
+    Asynchronously query an LLM with a prompt and optional image attachment.
+    
+    Shares the response and semantic caches with query_llm, which are only used at temperature 0.
+    
+    Args:
+        prompt (str): The text prompt to send
+        client: The async LLM client instance (see create_async_llm_client)
+        model (str, optional): The model to use
+        provider (str): The API provider to use
+        image_path (str, optional): Path to an image file to attach
+        no_cache (bool): Skip the response cache and always query the provider
+        semantic_cache (bool): Also reuse responses to semantically similar prompts
+        temperature (float, optional): Sampling temperature; None uses the provider default (see query_llm)
+        
+    Returns:
+        Optional[str]: The LLM's response or None if there was an error
+    """
+    load_environment()
+    
+    return await _aquery_llm(prompt, client, model, provider, image_path, no_cache, semantic_cache, temperature)
+
+async def _aquery_llm(prompt: str, client, model, provider: str, image_path: Optional[str], no_cache: bool,
+                      semantic_cache: bool, temperature: Optional[float] = None,
+                      pending_cache_writes: Optional[list] = None) -> Optional[str]:
+    """Implementation of aquery_llm; appends (key, response) to pending_cache_writes instead of writing through if given"""
+    # Set default model
+    if model is None:
+        model = _default_model(provider)
+    
+    # Only unsampled answers are reused: a sampled one may be the bad answer a caller is asking again about
+    use_cache = temperature == 0 and not no_cache
+    response_cache = get_response_cache() if use_cache else None
+    cache_key = _response_cache_key(provider, model, prompt, image_path) if use_cache else None
+    if cache_key:
+        cached = response_cache.get(cache_key)
+        if cached is not None:
+            return cached
+    
+    embedding = None
+    semantic_namespace = f"{provider}:{model}"
+    if semantic_cache and use_cache and not image_path:
+        embedding = await asyncio.to_thread(_embed_prompt, prompt)
+        if embedding is not None:
+            cached = get_semantic_cache().lookup(semantic_namespace, embedding)
+            if cached is not None:
+                return cached
+    
+    # Cache miss: encode the image while the client and rate limiter are dealt with
+    image_future = _start_image_encoding(provider, image_path)
+    
+    owns_client = client is None
+    if owns_client:
+        client = create_async_llm_client(provider)
+    
+    try:
+        limiter = get_rate_limiter(provider)
+        reserved_tokens = await limiter.aacquire(_estimated_request_tokens(limiter, prompt, model))
+        
+        image = await asyncio.wrap_future(image_future) if image_future else None
+        result = None
+        response = None
+        if provider in ["openai", "local", "deepseek", "azure", "siliconflow"]:
+            kwargs = _openai_request_kwargs(prompt, model, provider, image, temperature)
+            response = await _awith_retries(lambda: client.chat.completions.create(**kwargs))
+            result = response.choices[0].message.content
             
-            response = client.messages.create(
-                model=model,
-                max_tokens=1000,
-                messages=messages
-            )
-            return response.content[0].text
+        elif provider == "anthropic":
+            kwargs = _anthropic_request_kwargs(prompt, model, image, temperature)
+            response = await _awith_retries(lambda: client.messages.create(**kwargs))
+            result = response.content[0].text
             
         elif provider == "gemini":
-            model = client.GenerativeModel(model)
-            if image_path:
-                file = genai.upload_file(image_path, mime_type="image/png")
-                chat_session = model.start_chat(
-                    history=[{
-                        "role": "user",
-                        "parts": [file, prompt]
-                    }]
-                )
-            else:
-                chat_session = model.start_chat(
-                    history=[{
-                        "role": "user",
-                        "parts": [prompt]
-                    }]
-                )
-            response = chat_session.send_message(prompt)
-            return response.text
+            model = _gemini_model(client, model)
+            history = await asyncio.to_thread(_gemini_history, prompt, image_path)
+            chat_session = model.start_chat(history=history)
+            kwargs = _gemini_send_kwargs(temperature)
+            response = await _awith_retries(lambda: chat_session.send_message_async(prompt, **kwargs))
+            result = response.text
+        
+        # Settle the rate limit reservation against what the provider actually counted
+        limiter.record_usage(reserved_tokens, _response_total_tokens(provider, response))
+        
+        if isinstance(result, str):
+            if cache_key:
+                if pending_cache_writes is not None:
+                    pending_cache_writes.append((cache_key, result))
+                else:
+                    response_cache.set(cache_key, result, expire=RESPONSE_CACHE_TTL)
+            if embedding is not None:
+                get_semantic_cache().add(semantic_namespace, embedding, result, expire=RESPONSE_CACHE_TTL)
+        return result
             
     except Exception as e:
         print(f"Error querying LLM: {e}", file=sys.stderr)
         return None
+    finally:
+        if owns_client and hasattr(client, "close"):
+            await client.close()
+
+async def aquery_llm_batch(prompts: List[str], client=None, model=None, provider="openai", concurrency: int = 10, no_cache: bool = False, semantic_cache: bool = False, temperature: Optional[float] = None) -> List[Optional[str]]:
+    """
+    Query an LLM with many prompts concurrently.
+    
+    Args:
+        prompts (List[str]): The text prompts to send
+        client: The async LLM client instance, shared by all requests
+        model (str, optional): The model to use
+        provider (str): The API provider to use
+        concurrency (int): Maximum number of requests in flight at once
+        no_cache (bool): Skip the response cache and always query the provider
+        semantic_cache (bool): Also reuse responses to semantically similar prompts
+        temperature (float, optional): Sampling temperature; None uses the provider default (see query_llm)
+        
+    Returns:
+        List[Optional[str]]: One response per prompt, in order, None where a request failed
+    """
+    load_environment()
+    
+    owns_client = client is None
+    if owns_client:
+        client = create_async_llm_client(provider)
+    
+    semaphore = asyncio.Semaphore(concurrency)
+    pending_cache_writes = []
+    
+    async def run(prompt):
+        async with semaphore:
+            return await _aquery_llm(prompt, client, model, provider, None, no_cache, semantic_cache, temperature, pending_cache_writes)
+    
+    try:
+        results = await asyncio.gather(*(run(p) for p in prompts), return_exceptions=True)
+    finally:
+        if owns_client and hasattr(client, "close"):
+            await client.close()
+        # Store the whole batch's responses in one write
+        if pending_cache_writes:
+            get_response_cache().set_many(pending_cache_writes, expire=RESPONSE_CACHE_TTL)
+    
+    return [None if isinstance(r, BaseException) else r for r in results]
+
+def query_llm_multi(prompts: List[str], client=None, model=None, provider="openai", max_tokens: int = 1000, poll_interval: float = 5.0, timeout: float = 3600.0, concurrency: int = 10) -> List[Optional[str]]:
+    """
+    Query an LLM with many prompts packed into as few API requests as possible.
+    
+    OpenAI, Azure and local servers receive all prompts in one legacy completions
+    request, which requires a completions-capable model (default for OpenAI:
+    gpt-3.5-turbo-instruct; Azure requires the deployment name passed as model,
+    otherwise ValueError is raised). Anthropic prompts are submitted as a Message
+    Batch and polled until it ends or timeout passes, which can take minutes. Other
+    providers fall back to concurrent query_llm calls on a thread pool.
+    
+    Args:
+        prompts (List[str]): The text prompts to send
+        client: The LLM client instance
+        model (str, optional): The model to use
+        provider (str): The API provider to use
+        max_tokens (int): Maximum tokens to generate per prompt
+        poll_interval (float): Seconds between Anthropic batch status checks
+        timeout (float): Seconds to wait for an Anthropic batch before cancelling it
+        concurrency (int): Maximum requests in flight for the fallback providers
+        
+    Returns:
+        List[Optional[str]]: One response per prompt, in order, None where a request failed
+    """
+    load_environment()
+    
+    if not prompts:
+        return []
+    
+    # The Azure default is a chat deployment, which the completions endpoint rejects
+    if provider == "azure" and model is None:
+        raise ValueError("query_llm_multi needs the Azure completions deployment passed as model")
+    
+    if client is None:
+        client = create_llm_client(provider)
+    
+    try:
+        if provider not in ["openai", "azure", "local", "anthropic"]:
+            with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="llm_api_multi") as executor:
+                return list(executor.map(lambda p: query_llm(p, client, model=model, provider=provider), prompts))
+        
+        # Set default model
+        if model is None:
+            model = "gpt-3.5-turbo-instruct" if provider == "openai" else _default_model(provider)
+        
+        if provider == "anthropic":
+            batch = _with_retries(lambda: client.messages.batches.create(requests=[
+                {
+                    "custom_id": str(i),
+                    "params": {
+                        "model": model,
+                        "max_tokens": max_tokens,
+                        "messages": _anthropic_messages(prompt)
+                    }
+                }
+                for i, prompt in enumerate(prompts)
+            ]))
+            deadline = time.monotonic() + timeout
+            while batch.processing_status != "ended":
+                if time.monotonic() >= deadline:
+                    try:
+                        client.messages.batches.cancel(batch.id)
+                    except Exception:
+                        pass
+                    raise TimeoutError(f"Anthropic batch {batch.id} did not end within {timeout:.0f}s; cancelled")
+                time.sleep(poll_interval)
+                batch = _with_retries(lambda: client.messages.batches.retrieve(batch.id))
+            
+            results = [None] * len(prompts)
+            for entry in client.messages.batches.results(batch.id):
+                if entry.result.type == "succeeded":
+                    results[int(entry.custom_id)] = entry.result.message.content[0].text
+            return results
+        
+        # One request carrying every prompt's tokens
+        limiter = get_rate_limiter(provider)
+        estimated_tokens = sum(estimate_tokens(p, model) + max_tokens for p in prompts) if limiter.limits_tokens else 0
+        reserved_tokens = limiter.acquire(estimated_tokens)
+        response = _with_retries(lambda: client.completions.create(model=model, prompt=prompts, max_tokens=max_tokens))
+        limiter.record_usage(reserved_tokens, _response_total_tokens(provider, response))
+        results = [None] * len(prompts)
+        for choice in sorted(response.choices, key=lambda c: c.index):
+            results[choice.index] = choice.text
+        return results
+        
+    except Exception as e:
+        print(f"Error querying LLM: {e}", file=sys.stderr)
+        return [None] * len(prompts)
+
+def _print_response(prompt: str, client, args):
+    """Query the LLM with one prompt using the CLI options and print the answer"""
+    if args.stream:
+        received = False
+        for chunk in query_llm_stream(prompt, client, model=args.model, provider=args.provider, image_path=args.image):
+            received = True
+            print(chunk, end="", flush=True)
+        if received:
+            print()
+        else:
+            print("Failed to get response from LLM")
+        return
+
+    response = query_llm(prompt, client, model=args.model, provider=args.provider, image_path=args.image, no_cache=args.no_cache, semantic_cache=args.semantic_cache, temperature=args.temperature)
+    if response:
+        print(response)
+    else:
+        print("Failed to get response from LLM")
+
+def _repl(client, args):
+    """Answer prompts read one per line from stdin until EOF, reusing the same client"""
+    interactive = sys.stdin.isatty()
+    while True:
+        try:
+            prompt = input(">>> " if interactive else "")
+        except (EOFError, KeyboardInterrupt):
+            if interactive:
+                print()
+            return
+        if prompt.strip():
+            _print_response(prompt, client, args)
+            sys.stdout.flush()
 
 def main():
     parser = argparse.ArgumentParser(description='Query an LLM with a prompt')
-    parser.add_argument('--prompt', type=str, help='The prompt to send to the LLM', required=True)
+    parser.add_argument('--prompt', type=str, help='The prompt to send to the LLM (required unless --repl is given)')
     parser.add_argument('--provider', choices=['openai','anthropic','gemini','local','deepseek','azure','siliconflow'], default='openai', help='The API provider to use')
     parser.add_argument('--model', type=str, help='The model to use (default depends on provider)')
     parser.add_argument('--image', type=str, help='Path to an image file to attach to the prompt')
+    parser.add_argument('--temperature', type=float, help='Sampling temperature (default depends on provider); responses are only cached at 0')
+    parser.add_argument('--no-cache', action='store_true', help='Skip the response cache and always query the provider')
+    parser.add_argument('--semantic-cache', action='store_true', help='Reuse responses to semantically similar earlier prompts')
+    parser.add_argument('--stream', action='store_true', help='Print the response as it is generated')
+    parser.add_argument('--repl', action='store_true', help='After --prompt (if any), keep answering prompts read one per line from stdin, reusing the same client')
     args = parser.parse_args()
 
+    if not args.prompt and not args.repl:
+        parser.error("--prompt is required unless --repl is given")
+
+    load_environment()
+
     if not args.model:
-        if args.provider == 'openai':
-            args.model = "gpt-4o" 
-        elif args.provider == "deepseek":
-            args.model = "deepseek-chat"
-        elif args.provider == "siliconflow":
-            args.model = "deepseek-ai/DeepSeek-R1"
-        elif args.provider == 'anthropic':
-            args.model = "claude-3-5-sonnet-20241022"
-        elif args.provider == 'gemini':
-            args.model = "gemini-2.0-flash-exp"
-        elif args.provider == 'azure':
-            args.model = os.getenv('AZURE_OPENAI_MODEL_DEPLOYMENT', 'gpt-4o-ms')  # Get from env with fallback
+        args.model = _default_model(args.provider)
 
     client = create_llm_client(args.provider)
-    response = query_llm(args.prompt, client, model=args.model, provider=args.provider, image_path=args.image)
-    if response:
-        print(response)
-    else:
-        print("Failed to get response from LLM")
+    if args.prompt:
+        _print_response(args.prompt, client, args)
+    if args.repl:
+        _repl(client, args)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,319 @@
+#!/usr/bin/env python3
+
+import atexit
+import hashlib
+import json
+import os
+import sqlite3
+import sys
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Optional, List
+
+import numpy as np
+
+# Minimum cosine similarity for a stored prompt to count as a match
+SEMANTIC_SIMILARITY_THRESHOLD = 0.92
+
+def make_cache_key(provider: str, model: Optional[str], prompt: str, image_path: Optional[str] = None) -> str:
+    """
+    Build a cache key for an LLM request.
+
+    Args:
+        provider (str): The API provider
+        model (str, optional): The model name
+        prompt (str): The text prompt
+        image_path (str, optional): Path to an attached image; identified by absolute path,
+            modification time and size, like encode_image_file, so the file is not read
+
+    Returns:
+        str: Hex SHA-256 digest identifying the request
+    """
+    image = None
+    if image_path:
+        path = os.path.abspath(image_path)
+        stat = os.stat(path)
+        image = [path, stat.st_mtime_ns, stat.st_size]
+    payload = json.dumps(
+        {"provider": provider, "model": model, "prompt": prompt, "img": image},
+        sort_keys=True
+    )
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+class ResponseCache:
+    """
+    Exact-match LLM response cache: an in-memory LRU in front of an optional SQLite file.
+    """
+
+    def __init__(self, path: Optional[str] = None, maxsize: int = 256):
+        """
+        Args:
+            path (str, optional): SQLite file to persist entries in. If None, entries are kept in memory only.
+            maxsize (int): Maximum number of entries kept in memory
+        """
+        self.maxsize = maxsize
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._db = None
+        if path:
+            try:
+                Path(path).parent.mkdir(parents=True, exist_ok=True)
+                self._db = sqlite3.connect(str(path), check_same_thread=False)
+                self._db.execute(
+                    "CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, value TEXT, expires REAL)"
+                )
+                self._db.commit()
+            except sqlite3.Error as e:
+                print(f"Warning: LLM response cache disabled on disk: {e}", file=sys.stderr)
+                self._db = None
+
+    def get(self, key: str) -> Optional[str]:
+        """Return the cached response for key, or None if missing or expired"""
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                value, expires = entry
+                if expires is None or expires > now:
+                    self._memory.move_to_end(key)
+                    return value
+                del self._memory[key]
+
+            if self._db is None:
+                return None
+            row = self._db.execute(
+                "SELECT value, expires FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            value, expires = row
+            if expires is not None and expires <= now:
+                self._db.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self._db.commit()
+                return None
+            self._remember(key, value, expires)
+            return value
+
+    def set(self, key: str, value: str, expire: Optional[float] = 3600):
+        """Store value under key, expiring after expire seconds (never if None)"""
+        expires = time.time() + expire if expire is not None else None
+        with self._lock:
+            self._remember(key, value, expires)
+            if self._db is not None:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO responses (key, value, expires) VALUES (?, ?, ?)",
+                    (key, value, expires)
+                )
+                self._db.commit()
+
+    def set_many(self, items, expire: Optional[float] = 3600):
+        """Store several (key, value) pairs in a single disk transaction"""
+        items = list(items)
+        expires = time.time() + expire if expire is not None else None
+        with self._lock:
+            for key, value in items:
+                self._remember(key, value, expires)
+            if self._db is not None:
+                self._db.executemany(
+                    "INSERT OR REPLACE INTO responses (key, value, expires) VALUES (?, ?, ?)",
+                    [(key, value, expires) for key, value in items]
+                )
+                self._db.commit()
+
+    def clear(self):
+        """Remove all entries"""
+        with self._lock:
+            self._memory.clear()
+            if self._db is not None:
+                self._db.execute("DELETE FROM responses")
+                self._db.commit()
+
+    def _remember(self, key, value, expires):
+        self._memory[key] = (value, expires)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.maxsize:
+            self._memory.popitem(last=False)
+
+class SemanticCache:
+    """
+    Embedding-similarity LLM response cache for near-duplicate prompts.
+
+    Entries are grouped by namespace (e.g. provider and model) so a response is only
+    reused for the model that produced it. At most maxsize entries are kept; once full,
+    each new entry replaces the oldest. Embeddings and expiry times are persisted in an
+    .npz file and namespaces and responses in a JSON file beside it, written every
+    save_every new entries and on flush().
+    """
+
+    def __init__(self, path: Optional[str] = None, threshold: float = SEMANTIC_SIMILARITY_THRESHOLD,
+                 maxsize: int = 1024, save_every: int = 16):
+        """
+        Args:
+            path (str, optional): .npz file to persist entries in. If None, entries are kept in memory only.
+            threshold (float): Minimum cosine similarity for a match
+            maxsize (int): Maximum number of entries kept
+            save_every (int): Number of new entries to collect before writing them to disk
+        """
+        self.path = path
+        self.threshold = threshold
+        self.maxsize = maxsize
+        self.save_every = save_every
+        self._lock = threading.Lock()
+        # Rows [0, _size) of these preallocated arrays hold entries; _next is the row the
+        # next entry goes to, which wraps around to the oldest entry once maxsize is reached
+        self._embeddings = None
+        self._norms = None
+        self._expires = None
+        self._namespaces: List[str] = []
+        self._responses: List[str] = []
+        self._size = 0
+        self._next = 0
+        self._unsaved = 0
+        if path and Path(path).exists():
+            try:
+                with np.load(path, allow_pickle=False) as data:
+                    embeddings = data["embeddings"].astype(np.float32)
+                    expires = data["expires"].astype(np.float64)
+                with open(self._entries_path(), encoding="utf-8") as f:
+                    entries = json.load(f)
+                namespaces, responses = entries["namespaces"], entries["responses"]
+                if not len(embeddings) == len(expires) == len(namespaces) == len(responses):
+                    raise ValueError("embeddings and entries do not match")
+                # Entries are stored oldest first; keep the newest unexpired ones
+                now = time.time()
+                for i in range(len(embeddings)):
+                    if expires[i] > now:
+                        self._append(namespaces[i], embeddings[i], responses[i], expires[i])
+            except (OSError, KeyError, TypeError, ValueError) as e:
+                print(f"Warning: could not load semantic cache from {path}: {e}", file=sys.stderr)
+                self._clear()
+
+    def _entries_path(self) -> Path:
+        return Path(self.path).with_suffix(".json")
+
+    def _clear(self):
+        self._embeddings = None
+        self._norms = None
+        self._expires = None
+        self._namespaces = []
+        self._responses = []
+        self._size = 0
+        self._next = 0
+
+    def _append(self, namespace: str, vector, response: str, expires: float):
+        if self._embeddings is None or vector.shape[0] != self._embeddings.shape[1]:
+            # First entry, or the embedding model changed: start over
+            self._clear()
+            self._embeddings = np.empty((0, vector.shape[0]), dtype=np.float32)
+            self._norms = np.empty(0, dtype=np.float32)
+            self._expires = np.empty(0, dtype=np.float64)
+        if self._next == len(self._embeddings):
+            # Grow in doubling blocks so adds stay amortized O(1)
+            capacity = min(max(2 * len(self._embeddings), 16), self.maxsize)
+            self._embeddings = self._grown(self._embeddings, capacity)
+            self._norms = self._grown(self._norms, capacity)
+            self._expires = self._grown(self._expires, capacity)
+        slot = self._next
+        self._embeddings[slot] = vector
+        self._norms[slot] = np.linalg.norm(vector)
+        self._expires[slot] = expires
+        if slot == len(self._namespaces):
+            self._namespaces.append(namespace)
+            self._responses.append(response)
+        else:
+            self._namespaces[slot] = namespace
+            self._responses[slot] = response
+        self._size = max(self._size, slot + 1)
+        self._next = (slot + 1) % self.maxsize
+
+    def _grown(self, array, capacity: int):
+        grown = np.zeros((capacity,) + array.shape[1:], dtype=array.dtype)
+        grown[:self._size] = array[:self._size]
+        return grown
+
+    def lookup(self, namespace: str, embedding) -> Optional[str]:
+        """Return the response stored for the most similar unexpired prompt in namespace, if above threshold"""
+        query = np.asarray(embedding, dtype=np.float32)
+        query_norm = np.linalg.norm(query)
+        now = time.time()
+        with self._lock:
+            if self._size == 0 or query_norm == 0:
+                return None
+            if query.shape[0] != self._embeddings.shape[1]:
+                return None
+            size = self._size
+            similarities = self._embeddings[:size] @ query / (self._norms[:size] * query_norm + 1e-12)
+            stale = (np.asarray(self._namespaces) != namespace) | (self._expires[:size] <= now)
+            similarities[stale] = -1.0
+            best = int(np.argmax(similarities))
+            if similarities[best] >= self.threshold:
+                return self._responses[best]
+        return None
+
+    def add(self, namespace: str, embedding, response: str, expire: Optional[float] = 3600):
+        """Store response for a prompt embedding, expiring after expire seconds (never if None)"""
+        vector = np.asarray(embedding, dtype=np.float32)
+        expires = time.time() + expire if expire is not None else np.inf
+        with self._lock:
+            self._append(namespace, vector, response, expires)
+            self._unsaved += 1
+            if self._unsaved >= self.save_every:
+                self._save()
+
+    def flush(self):
+        """Write entries not yet persisted to disk"""
+        with self._lock:
+            if self._unsaved:
+                self._save()
+
+    def _save(self):
+        if not self.path:
+            return
+        entries_path = self._entries_path()
+        # Oldest first, so loading into a smaller cache keeps the newest entries
+        order = list(range(self._next, self._size)) + list(range(self._next))
+        try:
+            Path(self.path).parent.mkdir(parents=True, exist_ok=True)
+            # Write both files before replacing either; a mismatched pair is discarded on load
+            with open(f"{self.path}.tmp", "wb") as f:
+                np.savez(f, embeddings=self._embeddings[order], expires=self._expires[order])
+            with open(f"{entries_path}.tmp", "w", encoding="utf-8") as f:
+                json.dump({
+                    "namespaces": [self._namespaces[i] for i in order],
+                    "responses": [self._responses[i] for i in order]
+                }, f)
+            os.replace(f"{entries_path}.tmp", entries_path)
+            os.replace(f"{self.path}.tmp", self.path)
+            self._unsaved = 0
+        except OSError as e:
+            print(f"Warning: could not save semantic cache to {self.path}: {e}", file=sys.stderr)
+
+_response_cache = None
+_semantic_cache = None
+
+def get_response_cache() -> ResponseCache:
+    """
+    Return the process-wide response cache.
+
+    Entries are kept in memory only, unless $LLM_CACHE_PATH names a SQLite file to
+    persist them in and share them between processes.
+    """
+    global _response_cache
+    if _response_cache is None:
+        _response_cache = ResponseCache(os.getenv('LLM_CACHE_PATH') or None)
+    return _response_cache
+
+def get_semantic_cache() -> SemanticCache:
+    """
+    Return the process-wide semantic cache.
+
+    Entries are kept in memory only, unless $LLM_SEMANTIC_CACHE_PATH names an .npz file to
+    persist them in; it is then flushed at exit.
+    """
+    global _semantic_cache
+    if _semantic_cache is None:
+        _semantic_cache = SemanticCache(os.getenv('LLM_SEMANTIC_CACHE_PATH') or None)
+        atexit.register(_semantic_cache.flush)
+    return _semantic_cache
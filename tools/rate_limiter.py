@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+
+import asyncio
+import os
+import threading
+import time
+from typing import Optional, Tuple
+
+try:
+    import tiktoken
+except ImportError:  # Token counts fall back to a characters-per-token estimate
+    tiktoken = None
+
+# Limits are off unless configured, since provider quotas depend on the account tier.
+# Set <PROVIDER>_RATE_LIMIT_RPM / <PROVIDER>_RATE_LIMIT_TPM to enable them; 0 means unlimited.
+
+def estimate_tokens(text: str, model: Optional[str] = None) -> int:
+    """
+    Estimate the number of tokens in text.
+
+    Uses tiktoken for models it knows when it is installed, otherwise assumes
+    about four characters per token.
+
+    Args:
+        text (str): The text to measure
+        model (str, optional): The model the text is sent to
+
+    Returns:
+        int: Estimated token count
+    """
+    if tiktoken is not None and model:
+        try:
+            return len(tiktoken.encoding_for_model(model).encode(text))
+        except Exception:
+            # Unknown model, or the encoding could not be downloaded on first use
+            pass
+    return len(text) // 4
+
+class _Bucket:
+    """Token bucket refilled continuously up to its per-minute capacity"""
+
+    def __init__(self, per_minute: float):
+        self.capacity = float(per_minute)
+        self.rate = self.capacity / 60.0
+        self.level = self.capacity
+        self.updated = time.monotonic()
+
+    def reserve(self, amount: float, now: float) -> Tuple[float, float]:
+        """Take amount from the bucket; return how long to wait until it is covered and the amount taken"""
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+        # Requests larger than the whole bucket would never fit; cap them at capacity
+        taken = min(amount, self.capacity)
+        self.level -= taken
+        return max(0.0, -self.level / self.rate), taken
+
+class RateLimiter:
+    """
+    Client-side requests-per-minute and tokens-per-minute limiter.
+
+    Each acquire reserves capacity immediately and waits until the buckets cover it,
+    so concurrent callers are paced in arrival order instead of overshooting the
+    provider's limits and being rejected.
+    """
+
+    def __init__(self, rpm: Optional[float] = None, tpm: Optional[float] = None):
+        """
+        Args:
+            rpm (float, optional): Requests per minute, or None for no request limit
+            tpm (float, optional): Tokens per minute, or None for no token limit
+        """
+        self._requests = _Bucket(rpm) if rpm else None
+        self._tokens = _Bucket(tpm) if tpm else None
+        self._lock = threading.Lock()
+
+    @property
+    def limits_tokens(self) -> bool:
+        """Whether a tokens-per-minute limit applies, i.e. whether token estimates are needed at all"""
+        return self._tokens is not None
+
+    def _reserve(self, estimated_tokens: int) -> Tuple[float, float]:
+        now = time.monotonic()
+        with self._lock:
+            wait, reserved = 0.0, estimated_tokens
+            if self._requests is not None:
+                wait = max(wait, self._requests.reserve(1, now)[0])
+            if self._tokens is not None:
+                token_wait, reserved = self._tokens.reserve(estimated_tokens, now)
+                wait = max(wait, token_wait)
+            return wait, reserved
+
+    def record_usage(self, reserved_tokens: float, actual_tokens: Optional[int]):
+        """
+        Correct an earlier reservation once the provider reports real usage.
+
+        Tokens reserved but not used are returned to the bucket; usage above the
+        reservation is taken from it, delaying later requests.
+
+        Args:
+            reserved_tokens (float): Tokens actually reserved, as returned by acquire
+            actual_tokens (int, optional): Tokens the provider counted, or None if unknown
+        """
+        if self._tokens is None or actual_tokens is None:
+            return
+        with self._lock:
+            level = self._tokens.level + reserved_tokens - actual_tokens
+            self._tokens.level = max(-self._tokens.capacity, min(self._tokens.capacity, level))
+
+    def acquire(self, estimated_tokens: int = 0) -> float:
+        """Block until a request of estimated_tokens tokens fits within the limits; return the tokens reserved"""
+        wait, reserved = self._reserve(estimated_tokens)
+        if wait > 0:
+            time.sleep(wait)
+        return reserved
+
+    async def aacquire(self, estimated_tokens: int = 0) -> float:
+        """Wait without blocking the event loop until a request of estimated_tokens tokens fits; return the tokens reserved"""
+        wait, reserved = self._reserve(estimated_tokens)
+        if wait > 0:
+            await asyncio.sleep(wait)
+        return reserved
+
+_rate_limiters = {}
+_rate_limiters_lock = threading.Lock()
+
+def _limit_from_env(name: str) -> Optional[float]:
+    value = os.getenv(name)
+    if value is None or value.strip() == "":
+        return None
+    return float(value) or None
+
+def get_rate_limiter(provider: str) -> RateLimiter:
+    """Return the process-wide rate limiter for a provider, unlimited unless configured in the environment"""
+    with _rate_limiters_lock:
+        limiter = _rate_limiters.get(provider)
+        if limiter is None:
+            prefix = provider.upper()
+            limiter = RateLimiter(
+                rpm=_limit_from_env(f"{prefix}_RATE_LIMIT_RPM"),
+                tpm=_limit_from_env(f"{prefix}_RATE_LIMIT_TPM")
+            )
+            _rate_limiters[provider] = limiter
+        return limiter